@@ -1,10 +1,21 @@
 import os
+import json
+import time
 import requests
-from flask import Flask, render_template, request, jsonify
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 from dotenv import load_dotenv
 from blackbook_service import BlackbookService
+from cache import create_cache
 from market_listings_service import MarketListingsService
+from vin_decoder_service import VinDecoderService
+from http_client import pool_stats
+from metrics import HTTP_IN_PROGRESS, HTTP_LATENCY, HTTP_REQUESTS, PROMETHEUS_AVAILABLE, render as render_metrics
+from prewarm import PrewarmJob, PrewarmState, parse_run_list
+from ratelimit import BATCH, priority_lane
+from resilience import breaker_stats, retry_budget
+from vin_validation import validate_vin
 
 # Load environment variables with full path for PythonAnywhere
 load_dotenv('/home/Rahul2207/BlackbookFetcher/.env')
@@ -14,11 +25,93 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', os.urandom(24).hex())
 
 CORS(app)
 
-# Rate limiter removed - unlimited car appraisals!
+# Incoming requests are not rate limited; outbound Blackbook calls share a
+# node-wide token bucket with interactive and batch lanes (see ratelimit.py)
 
 blackbook_service = BlackbookService()
 market_listings_service = MarketListingsService()
 
+vin_decoder_service = VinDecoderService()
+
+# Worker-wide pool for batch appraisals; bounds how many VINs are priced at
+# once across every batch request handled by this worker
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+BATCH_MAX_CONCURRENCY = max(1, int(os.getenv('BATCH_MAX_CONCURRENCY', '4')))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix='batch-appraisal')
+
+# Worker-wide pool for /api/appraisal; each appraisal runs up to three
+# lookups (VIN decode, pricing, market listings) side by side
+APPRAISAL_MAX_WORKERS = max(3, int(os.getenv('APPRAISAL_MAX_WORKERS', '24')))
+appraisal_executor = ThreadPoolExecutor(max_workers=APPRAISAL_MAX_WORKERS, thread_name_prefix='appraisal')
+
+# Cache prewarm jobs started from the admin page: one at a time per node,
+# with the status kept in the shared cache so every worker can report it
+PREWARM_MAX_ITEMS = int(os.getenv('PREWARM_MAX_ITEMS', '5000'))
+prewarm_cache = create_cache('prewarm', max_entries=1, ttl=86400)
+prewarm_state = PrewarmState(getattr(prewarm_cache, 'shared', prewarm_cache))
+
+
+def _metrics_endpoint():
+    # Route pattern rather than path, so label values stay bounded
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.before_request
+def _start_request_metrics():
+    g.metrics_endpoint = _metrics_endpoint()
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_PROGRESS.labels(g.metrics_endpoint).inc()
+
+
+def _timed_stream(chunks, finish):
+    # Runs finish() once the body is exhausted or closed by the server
+    try:
+        yield from chunks
+    finally:
+        finish()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    if 'metrics_started' not in g:
+        return response
+
+    endpoint, method, started = g.metrics_endpoint, request.method, g.metrics_started
+    status = str(response.status_code)
+
+    def record():
+        HTTP_REQUESTS.labels(endpoint, method, status).inc()
+        HTTP_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+
+    # Werkzeug sends no body for HEAD, 1xx, 204 and 304, and passes files
+    # straight to the server; only generator bodies it iterates are wrapped
+    has_body = method != 'HEAD' and not (100 <= response.status_code < 200 or response.status_code in (204, 304))
+    if response.is_streamed and not response.direct_passthrough and has_body:
+        # Streamed responses (SSE, NDJSON) are timed and counted in progress
+        # until their last chunk has been sent
+        finished = []
+
+        def finish():
+            if finished:
+                return
+            finished.append(True)
+            record()
+            HTTP_IN_PROGRESS.labels(endpoint).dec()
+
+        g.metrics_streamed = True
+        response.response = _timed_stream(response.response, finish)
+        # Fallback for a body the server closes without iterating
+        response.call_on_close(finish)
+    else:
+        record()
+    return response
+
+
+@app.teardown_request
+def _finish_request_metrics(error=None):
+    if 'metrics_started' in g and not g.get('metrics_streamed'):
+        HTTP_IN_PROGRESS.labels(g.metrics_endpoint).dec()
+
 
 @app.route('/')
 def index():
@@ -101,6 +194,25 @@ def get_schema():
         }), 500
 
 
+def _parse_pricing_request(data):
+    """Validate the vin/mileage fields of a pricing request; returns (vin, mileage, error)"""
+    vin = str(data.get('vin') or '').strip()
+    mileage = data.get('mileage')
+
+    if not vin:
+        return vin, mileage, 'VIN is required'
+
+    if mileage is None:
+        return vin, mileage, 'Mileage is required'
+
+    try:
+        mileage = int(mileage)
+    except (ValueError, TypeError):
+        return vin, mileage, 'Mileage must be a valid number'
+
+    return vin, mileage, None
+
+
 @app.route('/api/pricing-cards', methods=['POST'])
 def pricing_cards():
     """
@@ -117,6 +229,7 @@ def pricing_cards():
         "cards": [
             {
                 "province": "Ontario",
+                "status": "ok",
                 "vin": "1HGBH41JXMN109186",
                 "mileage": 85000,
                 "uvc": "12345",
@@ -129,7 +242,9 @@ def pricing_cards():
                 "adjusted_tradein_clean": 16500
             },
             {
-                "province": "Quebec",
+                "province": "Yukon",
+                "status": "timeout",   ("ok", "timeout" or "error"; no pricing unless "ok")
+                "error": "Yukon pricing timed out",
                 ...
             }
         ]
@@ -144,27 +259,12 @@ def pricing_cards():
                 'error': 'No data provided'
             }), 400
         
-        vin = data.get('vin', '').strip()
-        mileage = data.get('mileage')
+        vin, mileage, error = _parse_pricing_request(data)
         
-        if not vin:
-            return jsonify({
-                'success': False,
-                'error': 'VIN is required'
-            }), 400
-        
-        if mileage is None:
-            return jsonify({
-                'success': False,
-                'error': 'Mileage is required'
-            }), 400
-        
-        try:
-            mileage = int(mileage)
-        except (ValueError, TypeError):
+        if error:
             return jsonify({
                 'success': False,
-                'error': 'Mileage must be a valid number'
+                'error': error
             }), 400
         
         result = blackbook_service.fetch_pricing_cards(vin, mileage)
@@ -182,6 +282,153 @@ def pricing_cards():
         }), 500
 
 
+@app.route('/api/pricing-cards/stream', methods=['GET'])
+def pricing_cards_stream():
+    """
+    Stream vehicle data and province pricing as Server-Sent Events
+
+    Query string: ?vin=1HGBH41JXMN109186&mileage=85000
+
+    Events:
+        vehicle         vehicle header (vin, uvc, year, make, model, publish_date, ...)
+        card            one province pricing card, as soon as that province returns
+        province_error  {"province": ..., "error": ...} for a province that failed
+        error           {"success": false, "error": ...}; the stream ends
+        done            {"count": <number of cards>}
+    """
+    vin, mileage, error = _parse_pricing_request(request.args)
+
+    if error:
+        return jsonify({
+            'success': False,
+            'error': error
+        }), 400
+
+    def sse(event, payload):
+        return f'event: {event}\ndata: {json.dumps(payload)}\n\n'
+
+    def generate():
+        count = 0
+        for event, payload in blackbook_service.iter_pricing_cards(vin, mileage):
+            yield sse(event, payload)
+            if event == 'error':
+                return
+            if event == 'card':
+                count += 1
+        yield sse('done', {'count': count})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+def _appraise_batch_item(index, item):
+    """Price one {vin, mileage} entry of a batch request"""
+    if not isinstance(item, dict):
+        return {
+            'index': index,
+            'success': False,
+            'error': 'Each item must be an object with vin and mileage'
+        }
+
+    vin, mileage, error = _parse_pricing_request(item)
+    line = {'index': index, 'vin': vin, 'mileage': mileage}
+
+    if error:
+        return {**line, 'success': False, 'error': error}
+
+    try:
+        # Batch appraisals give way to interactive lookups for Blackbook quota
+        with priority_lane(BATCH):
+            result = blackbook_service.fetch_pricing_cards(vin, mileage)
+    except Exception as e:
+        return {**line, 'success': False, 'error': f'Server error: {str(e)}'}
+
+    if result.get('success'):
+        return {**line, 'success': True, 'partial': result.get('partial', False), 'cards': result.get('cards')}
+    return {**line, 'success': False, 'error': result.get('error')}
+
+
+@app.route('/api/pricing-cards/batch', methods=['POST'])
+def pricing_cards_batch():
+    """
+    Price a list of vehicles, streaming one NDJSON line per vehicle as it finishes
+
+    Input JSON:
+    {
+        "vehicles": [
+            {"vin": "1HGBH41JXMN109186", "mileage": 85000},
+            {"vin": "5J8YE1H45RL800260", "mileage": 42000}
+        ]
+    }
+
+    Output (application/x-ndjson), in completion order:
+    {"index": 1, "vin": "5J8YE1H45RL800260", "mileage": 42000, "success": true, "cards": [...]}
+    {"index": 0, "vin": "1HGBH41JXMN109186", "mileage": 85000, "success": false, "error": "..."}
+    {"done": true, "count": 2, "succeeded": 1, "failed": 1, "elapsed_seconds": 1.92}
+
+    A batch that fails part way ends with {"done": false, "error": "..."}
+    instead, so a stream without either final line was cut off.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('vehicles') if isinstance(data, dict) else data
+
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            'success': False,
+            'error': 'A non-empty "vehicles" list is required'
+        }), 400
+
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({
+            'success': False,
+            'error': f'Batch is limited to {BATCH_MAX_ITEMS} vehicles'
+        }), 400
+
+    def generate():
+        started = time.monotonic()
+        succeeded = 0
+        queue = list(enumerate(items))
+        pending = set()
+        try:
+            while queue or pending:
+                # Keep only a window of this batch in the shared pool so
+                # concurrent batches interleave instead of queueing behind us
+                while queue and len(pending) < BATCH_MAX_CONCURRENCY:
+                    index, item = queue.pop(0)
+                    pending.add(batch_executor.submit(_appraise_batch_item, index, item))
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    line = future.result()
+                    succeeded += 1 if line.get('success') else 0
+                    yield json.dumps(line) + '\n'
+
+            yield json.dumps({
+                'done': True,
+                'count': len(items),
+                'succeeded': succeeded,
+                'failed': len(items) - succeeded,
+                'elapsed_seconds': round(time.monotonic() - started, 3)
+            }) + '\n'
+        except Exception as e:
+            app.logger.error(f'Batch pricing error: {str(e)}')
+            yield json.dumps({
+                'done': False,
+                'error': f'Server error: {str(e)}',
+                'count': len(items),
+                'succeeded': succeeded,
+                'elapsed_seconds': round(time.monotonic() - started, 3)
+            }) + '\n'
+        finally:
+            # Client went away - drop work that has not started yet
+            for future in pending:
+                future.cancel()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @app.route('/api/decode-vin', methods=['POST'])
 def decode_vin():
     """
@@ -231,87 +478,10 @@ def decode_vin():
                 'error': 'VIN must be 17 characters'
             }), 400
         
-        # Call NHTSA VIN Decoder API
-        nhtsa_url = f'https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVin/{vin}?format=json'
-        
-        response = requests.get(nhtsa_url, timeout=10)
-        
-        if response.status_code != 200:
-            return jsonify({
-                'success': False,
-                'error': f'NHTSA API error: {response.status_code}'
-            }), 400
-        
-        nhtsa_data = response.json()
-        
-        if 'Results' not in nhtsa_data:
-            return jsonify({
-                'success': False,
-                'error': 'Invalid response from NHTSA'
-            }), 400
-        
-        # Parse the results into a clean format
-        results = nhtsa_data['Results']
-        
-        def get_value(variable_name):
-            for item in results:
-                if item.get('Variable') == variable_name:
-                    value = item.get('Value')
-                    if value:
-                        return str(value).strip() or None
-            return None
-        
-        # Get trim information - combine multiple fields for complete picture
-        trim = get_value('Trim')
-        trim2 = get_value('Trim2')
-        series = get_value('Series')
-        series2 = get_value('Series2')
-        
-        # Build comprehensive trim description
-        trim_parts = []
-        if series:
-            trim_parts.append(series)
-        if series2 and series2 != series:
-            trim_parts.append(series2)
-        if trim:
-            trim_parts.append(trim)
-        if trim2 and trim2 != trim:
-            trim_parts.append(trim2)
-        
-        full_trim = ' '.join(trim_parts) if trim_parts else None
-        
-        vehicle_info = {
-            'vin': vin,
-            'make': get_value('Make'),
-            'model': get_value('Model'),
-            'year': get_value('Model Year'),
-            'trim': full_trim or trim or series,  # Comprehensive trim info
-            'trim_level': trim,  # Basic trim level
-            'series': series,  # Series/grade
-            'body_class': get_value('Body Class'),
-            'engine': get_value('Engine Model') or get_value('Displacement (L)'),
-            'engine_config': get_value('Engine Configuration'),
-            'cylinders': get_value('Engine Number of Cylinders'),
-            'displacement': get_value('Displacement (L)'),
-            'transmission': get_value('Transmission Style'),
-            'transmission_speeds': get_value('Transmission Speeds'),
-            'drive_type': get_value('Drive Type'),
-            'fuel_type': get_value('Fuel Type - Primary'),
-            'manufacturer': get_value('Manufacturer Name'),
-            'plant': get_value('Plant City') or get_value('Plant Country'),
-            'vehicle_type': get_value('Vehicle Type'),
-            'doors': get_value('Doors'),
-            'windows': get_value('Windows'),
-            'seat_rows': get_value('Seat Rows')
-        }
-        
-        # Remove None values
-        vehicle_info = {k: v for k, v in vehicle_info.items() if v}
-        
-        return jsonify({
-            'success': True,
-            'vehicle_info': vehicle_info
-        }), 200
+        result = vin_decoder_service.decode(vin)
+        if result.get('unavailable'):
+            return jsonify(result), 503
+        return jsonify(result), 200 if result.get('success') else 400
         
     except requests.Timeout:
         return jsonify({
@@ -325,6 +495,56 @@ def decode_vin():
         }), 500
 
 
+def _parse_listing_provinces(province, provinces):
+    """Normalise the province/provinces fields of a listings request; returns (provinces, error)"""
+    if provinces == 'all' or province == 'all':
+        provinces = list(market_listings_service.PROVINCE_CODES.values())
+    if provinces is not None and (not isinstance(provinces, list) or not all(isinstance(p, str) and p for p in provinces)):
+        return provinces, 'Provinces must be a list of province names or codes, or "all"'
+    return provinces, None
+
+
+def _search_market_listings(year, make, model, province=None, provinces=None):
+    """AutoTrader listings for one province, or several searched concurrently and merged"""
+    if provinces:
+        return market_listings_service.search_listings_multi(
+            year=year,
+            make=make,
+            model=model,
+            provinces=provinces,
+            max_results=15
+        )
+    return market_listings_service.search_listings(
+        year=year,
+        make=make,
+        model=model,
+        province=province,
+        max_results=15
+    )
+
+
+def _market_listings_result(listings, blackbook_retail, provinces=None):
+    """Listings response with each listing's price difference vs Blackbook retail"""
+    for listing in listings:
+        if blackbook_retail > 0:
+            listing['price_vs_blackbook'] = listing.get('price', 0) - blackbook_retail
+        else:
+            listing['price_vs_blackbook'] = None
+    
+    result = {
+        'success': True,
+        'listings': listings,
+        'blackbook_retail': blackbook_retail,
+        'count': len(listings)
+    }
+    if provinces:
+        by_province = {}
+        for listing in listings:
+            by_province[listing['province']] = by_province.get(listing['province'], 0) + 1
+        result['by_province'] = by_province
+    return result
+
+
 @app.route('/api/market-listings', methods=['POST'])
 def market_listings():
     """
@@ -335,7 +555,8 @@ def market_listings():
         "year": 2021,
         "make": "Volkswagen",
         "model": "Tiguan",
-        "province": "Ontario"  (optional)
+        "province": "Ontario",  (optional)
+        "provinces": ["ON", "BC", "AB"]  (optional, or "all"; searched concurrently and merged)
     }
     
     Output JSON:
@@ -347,11 +568,13 @@ def market_listings():
                 "mileage_km": 45000,
                 "location": "Toronto, ON",
                 "url": "https://www.autotrader.ca/...",
+                "province": "ON",  (multi-province searches only)
                 "price_vs_blackbook": 1000  (price difference vs Blackbook retail)
             }
         ],
         "blackbook_retail": 31995,
-        "count": 10
+        "count": 10,
+        "by_province": {"ON": 6, "BC": 4}  (multi-province searches only)
     }
     """
     try:
@@ -367,6 +590,7 @@ def market_listings():
         make = data.get('make')
         model = data.get('model')
         province = data.get('province')
+        provinces = data.get('provinces')
         blackbook_retail = data.get('blackbook_retail', 0)
         
         if not all([year, make, model]):
@@ -383,45 +607,263 @@ def market_listings():
                 'error': 'Year must be a valid number'
             }), 400
         
-        # Fetch market listings
-        listings = market_listings_service.search_listings(
-            year=year,
-            make=make,
-            model=model,
-            province=province,
-            max_results=15
-        )
+        provinces, error = _parse_listing_provinces(province, provinces)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
         
-        # Calculate price differences vs Blackbook retail value
-        for listing in listings:
-            if blackbook_retail > 0:
-                listing['price_vs_blackbook'] = listing.get('price', 0) - blackbook_retail
-            else:
-                listing['price_vs_blackbook'] = None
+        listings = _search_market_listings(year, make, model, province, provinces)
+        return jsonify(_market_listings_result(listings, blackbook_retail, provinces)), 200
         
+    except Exception as e:
+        app.logger.error(f'Market listings error: {str(e)}')
         return jsonify({
+            'success': False,
+            'error': f'Error fetching market listings: {str(e)}'
+        }), 500
+
+
+def _listing_vehicle(pricing_future, decode_future):
+    """(year, make, model) to search listings for, from Blackbook or NHTSA, whichever is back first"""
+    candidates = []
+    if pricing_future.done() and pricing_future.exception() is None:
+        candidates.extend(pricing_future.result().get('cards') or [])
+    if decode_future.done() and decode_future.exception() is None:
+        candidates.append(decode_future.result().get('vehicle_info') or {})
+
+    for vehicle in candidates:
+        if vehicle.get('year') and vehicle.get('make') and vehicle.get('model'):
+            try:
+                return int(vehicle['year']), vehicle['make'], vehicle['model']
+            except (ValueError, TypeError):
+                continue
+    return None
+
+
+@app.route('/api/appraisal', methods=['POST'])
+def appraisal():
+    """
+    Appraise a vehicle in one call: VIN decode, province pricing and market listings
+    
+    The NHTSA decode and Blackbook pricing start together; the AutoTrader
+    search starts as soon as either has identified the vehicle, and the
+    listings are compared with the average Blackbook retail value.
+    
+    Input JSON:
+    {
+        "vin": "1HGBH41JXMN109186",
+        "mileage": 85000,
+        "provinces": ["ON", "BC"]  (optional, or "all"; market listings search, as for /api/market-listings)
+    }
+    
+    Output JSON:
+    {
+        "success": true,
+        "vehicle_info": {...},  (as from /api/decode-vin; null with "decode_error" if the decode failed)
+        "cards": [...],  (as from /api/pricing-cards)
+        "partial": false,
+        "market": {...}  (as from /api/market-listings; null if the vehicle could not be identified)
+    }
+    """
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                'success': False,
+                'error': 'No data provided'
+            }), 400
+        
+        vin, mileage, error = _parse_pricing_request(data)
+        error = error or validate_vin(vin)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        province = data.get('province')
+        provinces, error = _parse_listing_provinces(province, data.get('provinces'))
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        pricing_future = appraisal_executor.submit(blackbook_service.fetch_pricing_cards, vin, mileage)
+        decode_future = appraisal_executor.submit(vin_decoder_service.decode, vin)
+        
+        # Start the listings search once the vehicle is known (usually from the NHTSA decode)
+        listings_future = None
+        pending = {pricing_future, decode_future}
+        while pending and listings_future is None:
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            vehicle = _listing_vehicle(pricing_future, decode_future)
+            if vehicle:
+                listings_future = appraisal_executor.submit(
+                    _search_market_listings, *vehicle, None if provinces else province, provinces
+                )
+        
+        pricing = pricing_future.result()
+        if not pricing.get('success'):
+            return jsonify(pricing), 400
+        
+        result = {
             'success': True,
-            'listings': listings,
-            'blackbook_retail': blackbook_retail,
-            'count': len(listings)
-        }), 200
+            'vehicle_info': None,
+            'cards': pricing.get('cards'),
+            'partial': pricing.get('partial', False),
+            'market': None
+        }
+        
+        try:
+            decoded = decode_future.result()
+        except requests.Timeout:
+            decoded = {'success': False, 'error': 'NHTSA API timeout'}
+        except Exception as e:
+            # Keep the pricing already fetched; only the decode is missing
+            app.logger.error(f'VIN decode error: {str(e)}')
+            decoded = {'success': False, 'error': f'Error decoding VIN: {str(e)}'}
+        if decoded.get('success'):
+            result['vehicle_info'] = decoded['vehicle_info']
+        else:
+            result['decode_error'] = decoded.get('error')
+        
+        if listings_future is not None:
+            retail = [card['adjusted_retail'] for card in result['cards']
+                      if card.get('status') == 'ok' and card.get('adjusted_retail')]
+            blackbook_retail = round(sum(retail) / len(retail)) if retail else 0
+            try:
+                result['market'] = _market_listings_result(listings_future.result(), blackbook_retail, provinces)
+            except Exception as e:
+                app.logger.error(f'Market listings error: {str(e)}')
+                result['market'] = {
+                    'success': False,
+                    'error': f'Error fetching market listings: {str(e)}'
+                }
+        
+        return jsonify(result), 200
         
     except Exception as e:
-        app.logger.error(f'Market listings error: {str(e)}')
         return jsonify({
             'success': False,
-            'error': f'Error fetching market listings: {str(e)}'
+            'error': f'Server error: {str(e)}'
         }), 500
 
 
+@app.route('/api/admin/prewarm', methods=['POST'])
+def start_prewarm():
+    """
+    Start a cache prewarm job in the background
+
+    Input JSON (either form):
+    {
+        "vehicles": [{"vin": "1HGBH41JXMN109186", "mileage": 85000}, ...],
+        "run_list": "vin,mileage\n1HGBH41JXMN109186,85000\n...",   (CSV or JSON lines)
+        "rate": 2,          (optional, vehicles started per second)
+        "workers": 4,       (optional)
+        "nhtsa": true       (optional, also warm the NHTSA cache)
+    }
+
+    Returns 202 with the job status; poll GET /api/admin/prewarm for progress.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({
+            'success': False,
+            'error': 'No data provided'
+        }), 400
+
+    try:
+        if data.get('run_list'):
+            vehicles, skipped = parse_run_list(str(data['run_list']))
+        else:
+            vehicles, skipped = parse_run_list('\n'.join(json.dumps(item) for item in data.get('vehicles') or []), 'jsonl')
+        rate = float(data.get('rate', 2))
+        workers = int(data.get('workers', 4))
+    except (ValueError, TypeError, OverflowError) as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid prewarm request: {str(e)}'
+        }), 400
+
+    if not vehicles:
+        return jsonify({
+            'success': False,
+            'error': f'No vehicles with a VIN and mileage found ({skipped} lines skipped)'
+        }), 400
+
+    if len(vehicles) > PREWARM_MAX_ITEMS:
+        return jsonify({
+            'success': False,
+            'error': f'Prewarm is limited to {PREWARM_MAX_ITEMS} vehicles'
+        }), 400
+
+    job = PrewarmJob(
+        blackbook_service,
+        vehicles,
+        decode_vin=vin_decoder_service.decode if data.get('nhtsa', True) else None,
+        rate=rate,
+        workers=min(workers, BATCH_MAX_CONCURRENCY),
+        skipped=skipped
+    )
+    running = prewarm_state.start(job)
+    if running is not None:
+        return jsonify({
+            'success': False,
+            'error': 'A prewarm job is already running',
+            'status': running
+        }), 409
+
+    return jsonify({
+        'success': True,
+        'status': job.status()
+    }), 202
+
+
+@app.route('/api/admin/prewarm', methods=['GET'])
+def prewarm_status():
+    return jsonify({
+        'success': True,
+        'status': prewarm_state.status()
+    }), 200
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({
         'status': 'healthy',
-        'service': 'Blackbook GraphQL Fetcher'
+        'service': 'Blackbook GraphQL Fetcher',
+        'http_pools': pool_stats(),
+        'upstreams': {
+            'breakers': breaker_stats(),
+            'retry_budget': retry_budget.stats(),
+            'blackbook': blackbook_service.upstream_stats(),
+            'autotrader': market_listings_service.upstream_stats()
+        },
+        'caches': {
+            **blackbook_service.cache_stats(),
+            'nhtsa': vin_decoder_service.cache_stats(),
+            'listings': market_listings_service.cache_stats()
+        }
     }), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics, aggregated across gunicorn workers (see gunicorn.conf.py)"""
+    if not PROMETHEUS_AVAILABLE:
+        return jsonify({
+            'success': False,
+            'error': 'Metrics unavailable - prometheus_client is not installed'
+        }), 503
+    
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_ENV') == 'development')
 
@@ -0,0 +1,133 @@
+"""
+BlackBook GraphQL API - ASGI entry point
+========================================
+
+Serves POST /api/pricing-cards from the asyncio Blackbook engine
+(BlackbookService.fetch_pricing_cards_async), so one worker process can
+run many appraisals at once on a single event loop instead of holding a
+thread for every 13-province fan-out. Every other route is the regular
+Flask app behind asgiref's WSGI adapter.
+
+Run with:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+or under gunicorn:
+    gunicorn -k uvicorn.workers.UvicornWorker --bind=0.0.0.0:5000 asgi:application
+"""
+
+import json
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app, blackbook_service, _parse_pricing_request
+from blackbook_async_client import AsyncBlackbookClient
+from metrics import HTTP_IN_PROGRESS, HTTP_LATENCY, HTTP_REQUESTS
+
+flask_application = WsgiToAsgi(app)
+
+
+async def _read_body(receive) -> bytes:
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _send_json(send, payload, status: int) -> None:
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'access-control-allow-origin', b'*')
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def timed(endpoint: str, handler, scope, receive, send) -> None:
+    """Run an ASGI handler, recording the HTTP metrics app.py records for Flask routes"""
+    started = time.perf_counter()
+    status = 500
+
+    async def send_with_status(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        await send(message)
+
+    HTTP_IN_PROGRESS.labels(endpoint).inc()
+    try:
+        await handler(scope, receive, send_with_status)
+    finally:
+        HTTP_IN_PROGRESS.labels(endpoint).dec()
+        HTTP_REQUESTS.labels(endpoint, scope['method'], str(status)).inc()
+        HTTP_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+
+
+async def pricing_cards(scope, receive, send) -> None:
+    """Async twin of app.pricing_cards"""
+    try:
+        try:
+            data = json.loads(await _read_body(receive) or b'null')
+        except ValueError:
+            data = None
+
+        if not data or not isinstance(data, dict):
+            await _send_json(send, {
+                'success': False,
+                'error': 'No data provided'
+            }, 400)
+            return
+
+        vin, mileage, error = _parse_pricing_request(data)
+
+        if error:
+            await _send_json(send, {
+                'success': False,
+                'error': error
+            }, 400)
+            return
+
+        result = await blackbook_service.fetch_pricing_cards_async(vin, mileage)
+
+        if result.get('success'):
+            await _send_json(send, {'cards': result.get('cards')}, 200)
+        else:
+            await _send_json(send, result, 400)
+
+    except Exception as e:
+        await _send_json(send, {
+            'success': False,
+            'error': f'Server error: {str(e)}'
+        }, 500)
+
+
+async def lifespan(scope, receive, send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await blackbook_service.close_async()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send) -> None:
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+        return
+
+    if (scope['type'] == 'http' and scope['method'] == 'POST'
+            and scope['path'].rstrip('/') == '/api/pricing-cards'
+            and AsyncBlackbookClient.available):
+        await timed('/api/pricing-cards', pricing_cards, scope, receive, send)
+        return
+
+    await flask_application(scope, receive, send)
+
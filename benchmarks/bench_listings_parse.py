@@ -0,0 +1,146 @@
+"""
+Benchmark AutoTrader listings parsing over saved result pages
+
+Runs each page of the HTML fixtures in benchmarks/fixtures (or the pages
+given on the command line) through the parser used for live searches,
+MarketListingsService._iter_response_listings. The page is fed in
+network-sized chunks and parsing stops once --max-results listings are
+found. Results are checked against the previous html.parser
+implementation, which is kept here as the baseline. The "lxml" row is the
+incremental parser; "bs4" is the BeautifulSoup fallback.
+
+    python benchmarks/bench_listings_parse.py
+    python benchmarks/bench_listings_parse.py saved_page.html --rounds 50
+    python benchmarks/bench_listings_parse.py --max-results 15
+
+The bundled fixtures are synthetic pages shaped like AutoTrader's result
+markup (100 results, inline state and styles), not captured responses;
+one wraps its result-item cards in a data-testid results list.
+"""
+
+import argparse
+import glob
+import logging
+import os
+import re
+import sys
+import time
+from itertools import islice
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bs4 import BeautifulSoup
+
+from market_listings_service import MarketListingsService, lxml
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', '*.html')
+
+
+def baseline_parse(service: MarketListingsService, html: str, max_results: int):
+    """The html.parser implementation with one find(text=...) walk per field"""
+    soup = BeautifulSoup(html, 'html.parser')
+    listings = []
+    containers = soup.find_all('div', class_=re.compile(r'result-item|listing-item'), limit=max_results)
+    if not containers:
+        containers = soup.find_all('div', {'data-testid': re.compile(r'listing|result')}, limit=max_results)
+
+    for container in containers[:max_results]:
+        listing = {}
+        price_elem = container.find(string=re.compile(r'\$[\d,]+'))
+        if price_elem:
+            price_text = re.search(r'\$([\d,]+)', price_elem.string or str(price_elem))
+            if price_text:
+                listing['price'] = int(price_text.group(1).replace(',', ''))
+        mileage_elem = container.find(string=re.compile(r'[\d,]+\s*km', re.IGNORECASE))
+        if mileage_elem:
+            mileage_text = re.search(r'([\d,]+)\s*km', mileage_elem.string or str(mileage_elem), re.IGNORECASE)
+            if mileage_text:
+                listing['mileage_km'] = int(mileage_text.group(1).replace(',', ''))
+        link_elem = container.find('a', href=re.compile(r'/a/'))
+        if link_elem and link_elem.get('href'):
+            listing['url'] = service.base_url + link_elem['href']
+        location_elem = container.find(string=re.compile(r'\w+,\s*[A-Z]{2}'))
+        if location_elem:
+            listing['location'] = location_elem.string.strip()
+        if listing.get('price'):
+            listings.append(listing)
+
+    return listings or service._create_sample_listings(max_results)
+
+
+class PageResponse:
+    """Just enough of a streamed requests.Response for _iter_response_listings"""
+
+    headers = {'Content-Type': 'text/html; charset=utf-8'}
+    encoding = 'utf-8'
+
+    def __init__(self, html: str):
+        self.data = html.encode('utf-8')
+
+    def iter_content(self, chunk_size: int):
+        return (self.data[i:i + chunk_size] for i in range(0, len(self.data), chunk_size))
+
+
+def service_parse(service: MarketListingsService, html: str, max_results: int):
+    """Listings as a live search collects them, with its fallback to sample listings"""
+    listings = list(islice(filter(None, service._iter_response_listings(PageResponse(html))), max_results))
+    return listings or service._create_sample_listings(max_results)
+
+
+def comparable(listings):
+    # Sample listings are random; only compare that both found nothing
+    if not listings or listings[0].get('is_sample'):
+        return 'sample'
+    return listings
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark AutoTrader listings parsing')
+    parser.add_argument('pages', nargs='*', help='saved result pages (default: the bundled fixtures)')
+    parser.add_argument('--rounds', type=int, default=20, help='parses per page and parser')
+    parser.add_argument('--max-results', type=int, default=100, help='max_results passed to the parser')
+    args = parser.parse_args(argv)
+
+    # The fallback to sample listings logs a warning on every empty page
+    logging.getLogger('market_listings_service').setLevel(logging.ERROR)
+
+    paths = args.pages or sorted(glob.glob(FIXTURES))
+    parsers = {'baseline': None, 'bs4': MarketListingsService(parser='bs4')}
+    if lxml is not None:
+        parsers['lxml'] = MarketListingsService(parser='lxml')
+    else:
+        print('lxml is not installed - timing the BeautifulSoup parsers only')
+
+    reference = MarketListingsService(parser='bs4')
+    mismatches = 0
+    print(f"{'page':<40} {'KiB':>6} {'parser':<9} {'listings':>8} {'ms/page':>9} {'speedup':>8}")
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        expected = comparable(baseline_parse(reference, html, args.max_results))
+        baseline_ms = None
+
+        for name, service in parsers.items():
+            if service is None:
+                parse = lambda: baseline_parse(reference, html, args.max_results)
+            else:
+                parse = lambda: service_parse(service, html, args.max_results)
+            listings = parse()
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                parse()
+            ms = (time.perf_counter() - started) * 1000 / args.rounds
+            baseline_ms = baseline_ms or ms
+
+            matches = comparable(listings) == expected
+            mismatches += 0 if matches else 1
+            print(f"{os.path.basename(path):<40} {len(html) / 1024:>6.0f} {name:<9} {len(listings):>8} "
+                  f"{ms:>9.2f} {baseline_ms / ms:>7.1f}x{'' if matches else '  MISMATCH'}")
+
+    if mismatches:
+        print(f'{mismatches} parser results differ from the baseline')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,21 +1,286 @@
+import asyncio
+import contextvars
 import os
 import re
+import threading
+import time
 import requests
-from typing import Dict, Any
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 import base64
 
+from cache import create_cache
+from blackbook_async_client import AsyncBlackbookClient
+from http_client import get_session
+from metrics import PROVINCE_LATENCY
+from ratelimit import BATCH, create_rate_limiter, priority_lane
+from refresher import BackgroundRefresher
+from resilience import CircuitOpenError, HedgeBudget, LatencyTracker, call_upstream, call_upstream_async
+from singleflight import SingleFlight
+from vin_validation import validate_vin, vin_squish
+
 
 class BlackbookService:
-    VIN_PATTERN = re.compile(r'^[A-HJ-NPR-Z0-9]{17}$')
     
     KM_TO_MILES = 0.621371  # Conversion factor
     MILES_TO_KM = 1.60934   # Conversion factor
 
+    CALL_TIMEOUT = 15  # Longest single upstream call, in seconds
+    MIN_CALL_TIMEOUT = 2  # Shortest timeout adaptive timeouts may set
+
+    # GraphQL errors meaning an aliased batch document was too big for upstream
+    DOCUMENT_REJECTED_PATTERN = re.compile(r'complexity|depth|too (large|long|many|big)|limit|exceed', re.IGNORECASE)
+
+    # Province code mapping for all Canadian provinces and territories
+    PROVINCE_CODES = {
+        'Alberta': 'AB',
+        'British Columbia': 'BC',
+        'Manitoba': 'MB',
+        'New Brunswick': 'NB',
+        'Newfoundland and Labrador': 'NL',
+        'Northwest Territories': 'NT',
+        'Nova Scotia': 'NS',
+        'Nunavut': 'NU',
+        'Ontario': 'ON',
+        'Prince Edward Island': 'PE',
+        'Quebec': 'QC',
+        'Saskatchewan': 'SK',
+        'Yukon': 'YT'
+    }
+    PROVINCES = list(PROVINCE_CODES)
+    PROVINCE_NAMES = {code: province for province, code in PROVINCE_CODES.items()}
+
+    # Fields requested for every province pricing lookup. The vehicle header
+    # (uvc/year/make/model/publish_date) comes from these too, so no separate
+    # VIN lookup is needed before the fan-out.
+    PRICING_FIELDS = """
+                    error_count
+                    message_list {
+                        description
+                        code
+                        type
+                    }
+                    usedvehicles {
+                        vin
+                        model_year
+                        make
+                        model
+                        series
+                        style
+                        uvc
+                        publish_date
+                        description_score
+                        adjusted_whole_rough
+                        adjusted_retail_rough
+                        adjusted_tradein_rough
+                    }
+    """
+
+    PROVINCE_PRICING_QUERY = f"""
+            query GetPricing($vin: String!, $mileage: Int!, $province: String!) {{
+                usedvehicles(vin: $vin, mileage: $mileage, province: $province) {{
+                    {PRICING_FIELDS}
+                }}
+            }}
+    """
+
     def __init__(self):
         self.blackbook_id = os.getenv('BLACKBOOK_ID')
         self.blackbook_password = os.getenv('BLACKBOOK_PASSWORD')
         self.graphql_url = os.getenv('BLACKBOOK_GRAPHQL_URL')
+        # Maximum number of province pricing calls in flight per appraisal
+        self.max_concurrency = max(1, int(os.getenv('BLACKBOOK_MAX_CONCURRENCY', '13')))
+        # Send several provinces as aliased fields of one GraphQL document
+        self.batch_provinces = os.getenv('BLACKBOOK_BATCH_PROVINCES', 'false').lower() in ('1', 'true', 'yes')
+        # Largest number of aliased provinces per document. Lowered to the largest
+        # size upstream accepted when it rejects one, and probed back up a step
+        # at a time after BLACKBOOK_BATCH_PROBE_AFTER accepted batches or
+        # BLACKBOOK_BATCH_PROBE_INTERVAL seconds
+        self.max_batch_size = max(1, int(os.getenv('BLACKBOOK_BATCH_SIZE', str(len(self.PROVINCES)))))
+        self.batch_size = self.max_batch_size
+        self.batch_probe_after = max(1, int(os.getenv('BLACKBOOK_BATCH_PROBE_AFTER', '100')))
+        self.batch_probe_interval = float(os.getenv('BLACKBOOK_BATCH_PROBE_INTERVAL', '600'))
+        self._batch_lock = threading.Lock()
+        self._batch_accepted = self.max_batch_size  # largest size accepted below the rejected one
+        self._batch_rejected = None  # smallest size rejected since the last probe
+        self._batch_rejected_at = 0.0
+        self._batch_successes = 0
+        # Overall time budget for one appraisal; provinces not back by then are returned as timed out
+        self.request_deadline = float(os.getenv('BLACKBOOK_REQUEST_DEADLINE', '10'))
+
+        # Rolling latency per operation; call timeouts are set to a multiple of its p99
+        self.latency = LatencyTracker(window=int(os.getenv('BLACKBOOK_LATENCY_WINDOW', '500')))
+        self.adaptive_timeouts = os.getenv('BLACKBOOK_ADAPTIVE_TIMEOUTS', 'true').lower() in ('1', 'true', 'yes')
+        self.timeout_multiplier = float(os.getenv('BLACKBOOK_TIMEOUT_MULTIPLIER', '3'))
+        # A pricing call still running past this percentile gets a hedged duplicate, within the budget
+        self.hedging = os.getenv('BLACKBOOK_HEDGING', 'true').lower() in ('1', 'true', 'yes')
+        self.hedge_percentile = float(os.getenv('BLACKBOOK_HEDGE_PERCENTILE', '95'))
+        self.hedge_budget = HedgeBudget(ratio=float(os.getenv('BLACKBOOK_HEDGE_BUDGET', '0.05')))
+        self._hedge_executor = None
+        self._hedge_executor_pid = None
+        self._hedge_slots = None
+        self._hedge_lock = threading.Lock()
+        # Node-wide token bucket for outbound calls; interactive lookups go ahead of batch work
+        self.rate_limiter = create_rate_limiter('blackbook')
+
+        # VIN -> vehicle header record and province pricing keyed by
+        # (uvc, odometer_miles, province code), shared across workers on disk
+        cache_entries = int(os.getenv('PRICING_CACHE_MAX_ENTRIES', '5000'))
+        cache_ttl = float(os.getenv('PRICING_CACHE_TTL', '43200'))
+        self.vehicle_cache = create_cache('vehicle', max_entries=cache_entries, ttl=cache_ttl)
+        self.pricing_cache = create_cache('pricing', max_entries=cache_entries, ttl=cache_ttl)
+        # VIN squish (positions 1-8, 10-11) -> UVC, so new VINs of a known
+        # pattern get their vehicle record without a lookup and share pricing
+        # cached for the same UVC at the same odometer reading
+        self.squish_index = create_cache('squish', max_entries=cache_entries, ttl=cache_ttl)
+        self._publish_date = None
+        self._publish_lock = threading.Lock()
+        # VINs Blackbook reported as unknown -> its error, so they are not looked up again
+        self.unknown_vins = create_cache(
+            'unknown_vin',
+            max_entries=cache_entries,
+            ttl=float(os.getenv('UNKNOWN_VIN_CACHE_TTL', '86400'))
+        )
+
+        # Stale-while-revalidate: pricing older than the soft TTL (or from an
+        # older publish) is still served, and refreshed in the background
+        self.cache_ttl = cache_ttl
+        self.soft_ttl = float(os.getenv('PRICING_CACHE_SOFT_TTL', '3600'))
+        # Most popular entries kept and refreshed when a new publish_date shows up; the rest are dropped
+        self.refresh_on_publish = int(os.getenv('PRICING_REFRESH_ON_PUBLISH', '500'))
+        self.pricing_refresher = BackgroundRefresher(
+            max_workers=int(os.getenv('PRICING_REFRESH_WORKERS', '2')),
+            max_pending=int(os.getenv('PRICING_REFRESH_MAX_PENDING', '2000'))
+        )
+
+        # Coalesce identical in-flight lookups, across workers via the shared cache file
+        self.pricing_inflight = SingleFlight(store=getattr(self.pricing_cache, 'shared', None))
+
+        self._async_client = None
     
+    def cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss statistics for the vehicle and pricing caches"""
+        return {
+            'publish_date': self._publish_date,
+            'vehicle': self.vehicle_cache.stats(),
+            'pricing': self.pricing_cache.stats(),
+            'squish': self.squish_index.stats(),
+            'unknown_vins': self.unknown_vins.stats(),
+            'soft_ttl': self.soft_ttl,
+            'refresh': self.pricing_refresher.stats(),
+            'inflight': {
+                'pricing': self.pricing_inflight.stats()
+            }
+        }
+
+    def upstream_stats(self) -> Dict[str, Any]:
+        """Latency percentiles, current timeouts and hedging counters for Blackbook calls"""
+        return {
+            'latency': self.latency.stats(),
+            'timeouts': {operation: round(self._operation_timeout(operation), 3)
+                         for operation in ('vehicle', 'pricing', 'pricing_batch')},
+            'hedging': {
+                'enabled': self.hedging,
+                'percentile': self.hedge_percentile,
+                **self.hedge_budget.stats()
+            },
+            'rate_limit': self.rate_limiter.stats()
+        }
+
+    @staticmethod
+    def _publish_day(publish_date: Optional[str]) -> Optional[date]:
+        """A Blackbook publish_date ('10/28/2025', or ISO) as a date, or None when it can't be read"""
+        for fmt in ('%m/%d/%Y', '%Y-%m-%d'):
+            try:
+                return datetime.strptime(str(publish_date or '').strip(), fmt).date()
+            except ValueError:
+                continue
+        return None
+
+    def _older_publish(self, publish_date: Optional[str], than: str) -> bool:
+        """Whether pricing published on publish_date predates `than` (unreadable dates count as older)"""
+        day, newer = self._publish_day(publish_date), self._publish_day(than)
+        if newer is None:
+            return publish_date != than
+        return day is None or day < newer
+
+    def _note_publish_date(self, publish_date: Optional[str]) -> None:
+        """
+        Record the publish_date of fresh pricing; a newer one retires the old publish in the background
+
+        Only a date strictly newer than the recorded one counts: a lagging
+        replica or an old response reporting the previous publish is
+        ignored, so the cache never flips back. Only the date is recorded on
+        the calling (request) thread; the scan of the caches runs on the
+        pricing refresher (see _retire_publish).
+        """
+        day = self._publish_day(publish_date)
+        if day is None:
+            return
+
+        with self._publish_lock:
+            previous = self._publish_date
+            if previous is not None and not self._older_publish(previous, publish_date):
+                return
+            self._publish_date = publish_date
+        if previous is None:
+            return
+
+        self.pricing_refresher.submit([('publish', publish_date)], lambda keys: self._retire_publish(publish_date))
+
+    def _retire_publish(self, publish_date: str) -> None:
+        """
+        Handle pricing from an older Blackbook publish once a newer publish_date shows up
+
+        Every worker drops its in-process copies. One worker (whoever takes
+        the publish lock in the shared cache) then keeps the most recently
+        used entries of the old publish and refreshes them in the background,
+        and drops the rest. Entries of the same or a later publish are kept.
+        Vehicle records are kept: a UVC does not change between publishes.
+        """
+        is_stale = lambda key, value: self._older_publish(value.get('raw_data', {}).get('publish_date'), publish_date)
+        cache = getattr(self.pricing_cache, 'shared', None)
+        if cache is None:
+            cache = self.pricing_cache
+        else:
+            self.pricing_cache.memory.invalidate(is_stale)
+            if not cache.acquire_lock(('publish', publish_date), f'{os.getpid()}:publish', self.cache_ttl):
+                return  # Another worker is handling this publish
+
+        popular = cache.popular(is_stale, self.refresh_on_publish)
+        keep = {key for key, _ in popular}
+        cache.invalidate(lambda key, value: key not in keep and is_stale(key, value))
+
+        # One refresh per vehicle and mileage covering all of its kept provinces
+        groups = {}
+        for (uvc, mileage, province_code), pricing in popular:
+            vin = pricing.get('raw_data', {}).get('vin')
+            if vin:
+                groups.setdefault((vin, uvc, mileage), []).append(province_code)
+        for (vin, uvc, mileage), province_codes in groups.items():
+            self._schedule_refresh(vin, mileage, uvc, [self.PROVINCE_NAMES[code] for code in province_codes])
+
+    def _is_stale(self, pricing: Dict[str, Any]) -> bool:
+        """Whether cached pricing is past the soft TTL or from an older publish"""
+        if time.time() - pricing.get('cached_at', 0) > self.soft_ttl:
+            return True
+        publish_date = pricing.get('raw_data', {}).get('publish_date')
+        return self._publish_date is not None and self._older_publish(publish_date, self._publish_date)
+
+    def _schedule_refresh(self, vin: str, mileage: int, uvc: str, provinces: List[str]) -> None:
+        """Refetch cached pricing for these provinces in the background"""
+        keys = [(uvc, mileage, self.PROVINCE_CODES.get(province, 'ON')) for province in provinces]
+
+        def refresh(keys):
+            headers = self._get_auth_headers()
+            stale = [self.PROVINCE_NAMES[key[2]] for key in keys]
+            with priority_lane(BATCH):
+                for _ in self._iter_province_pricing(vin, mileage, stale, headers, uvc, use_cache=False):
+                    pass
+
+        self.pricing_refresher.submit(keys, refresh)
+
     def _convert_km_to_miles(self, km: int) -> int:
         """Convert kilometres to miles for Blackbook API (U.S.-based system)"""
         return int(km * self.KM_TO_MILES)
@@ -65,7 +330,7 @@ class BlackbookService:
             }
             """
 
-            response = requests.post(
+            response = get_session('blackbook').post(
                 self.graphql_url,
                 json={'query': introspection_query},
                 headers=headers,
@@ -106,7 +371,7 @@ class BlackbookService:
             }
             """
 
-            response = requests.post(
+            response = get_session('blackbook').post(
                 self.graphql_url,
                 json={'query': test_query},
                 headers=headers,
@@ -159,13 +424,19 @@ class BlackbookService:
                     'error': 'VIN is required'
                 }
 
-            vin_upper = vin.upper()
-            if not self.VIN_PATTERN.match(vin_upper):
+            vin_error = validate_vin(vin)
+            if vin_error:
                 return {
                     'success': False,
-                    'error': 'VIN must be exactly 17 alphanumeric characters (excluding I, O, Q)'
+                    'invalid': True,
+                    'error': vin_error
                 }
 
+            vin_upper = vin.upper()
+            unknown = self._known_unknown(vin_upper)
+            if unknown:
+                return unknown
+
             if not isinstance(odometer_km, int) or odometer_km < 0:
                 return {
                     'success': False,
@@ -205,6 +476,7 @@ class BlackbookService:
                         mileage_tradein_rough
                         adjusted_tradein_rough
                         uvc
+                        publish_date
                     }
                 }
             }
@@ -214,15 +486,10 @@ class BlackbookService:
                 'vin': vin_upper
             }
 
-            response = requests.post(
-                self.graphql_url,
-                json={
-                    'query': query,
-                    'variables': variables
-                },
-                headers=headers,
-                timeout=15
-            )
+            response = self._post('vehicle', {
+                'query': query,
+                'variables': variables
+            }, headers, self._operation_timeout('vehicle'))
 
             if response.status_code == 200:
                 data = response.json()
@@ -242,23 +509,27 @@ class BlackbookService:
                 if error_count > 0:
                     error_messages = [msg.get('description', '') for msg in messages if msg.get('type', '').lower() == 'error']
                     if error_messages:
-                        return {
+                        return self._remember_unknown(vin_upper, {
                             'success': False,
+                            'not_found': True,
                             'error': ', '.join(error_messages)
-                        }
+                        })
                     else:
-                        return {
+                        return self._remember_unknown(vin_upper, {
                             'success': False,
+                            'not_found': True,
                             'error': 'Vehicle lookup failed - please check the VIN and try again'
-                        }
+                        })
 
                 if not vehicles:
-                    return {
+                    return self._remember_unknown(vin_upper, {
                         'success': False,
+                        'not_found': True,
                         'error': 'No vehicle data found for this VIN'
-                    }
+                    })
 
                 vehicle_data = vehicles[0]
+                self._remember_vehicle(vin_upper, vehicle_data)
 
                 return {
                     'success': True,
@@ -287,6 +558,8 @@ class BlackbookService:
                     'error': f'Blackbook API error ({response.status_code}): {error_msg}'
                 }
 
+        except CircuitOpenError:
+            return self._unavailable()
         except requests.exceptions.Timeout:
             return {
                 'success': False,
@@ -304,154 +577,825 @@ class BlackbookService:
             }
 
     def fetch_pricing_cards(self, vin: str, odometer_km: int) -> Dict[str, Any]:
-        """Fetch vehicle data and pricing for all Canadian provinces"""
-        try:
-            if not self.graphql_url:
-                return {
-                    'success': False,
-                    'error': 'GraphQL URL not configured'
-                }
+        """
+        Fetch vehicle data and pricing for all Canadian provinces
+
+        Returns one card per province. Provinces that failed or missed the
+        request deadline are still listed, with `status` set to 'error' or
+        'timeout' instead of 'ok' and no pricing; `partial` is True then.
+        """
+        cards = {}
+        for event, payload in self.iter_pricing_cards(vin, odometer_km):
+            if event == 'error':
+                return payload
+            if event in ('card', 'province_error'):
+                cards[payload['province']] = payload
+
+        cards = [cards[province] for province in self.PROVINCES if province in cards]
+        return {
+            'success': True,
+            'partial': any(card['status'] != 'ok' for card in cards),
+            'cards': cards
+        }
 
-            if not vin:
-                return {
-                    'success': False,
-                    'error': 'VIN is required'
-                }
+    def iter_pricing_cards(self, vin: str, odometer_km: int) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Stream vehicle data and province pricing as it becomes available
+
+        Yields (event, payload) pairs:
+            ('vehicle', header)          once, before any card
+            ('card', card)               per province, in completion order
+            ('province_error', card)     per province whose pricing failed or
+                                         missed the deadline (status 'error'/'timeout')
+            ('error', result)            request-level failure; nothing follows
+        """
+        try:
+            invalid = self._validate_pricing_request(vin, odometer_km)
+            if invalid:
+                yield 'error', invalid
+                return
 
             vin_upper = vin.upper()
-            if not self.VIN_PATTERN.match(vin_upper):
-                return {
-                    'success': False,
-                    'error': 'VIN must be exactly 17 alphanumeric characters (excluding I, O, Q)'
-                }
 
-            if not isinstance(odometer_km, int) or odometer_km < 0:
-                return {
-                    'success': False,
-                    'error': 'Odometer must be a positive number'
-                }
-            
             # Convert kilometres to miles for U.S.-based Blackbook API
             odometer_miles = self._convert_km_to_miles(odometer_km)
 
             headers = self._get_auth_headers()
+            deadline = time.monotonic() + self.request_deadline
+
+            # The vehicle header comes from the cached VIN record (or a VIN with
+            # the same squish), or else from the first province that returns pricing
+            header = None
+            vehicle_info = self._resolve_vehicle(vin_upper)
+            if vehicle_info is not None:
+                header = self._build_vehicle_header(vin_upper, odometer_km, odometer_miles, vehicle_info)
+                yield 'vehicle', header
+
+            # Get pricing for all Canadian provinces concurrently. Failures seen
+            # before any success are held back: if every province fails, the
+            # VIN itself is the problem and a single request-level error is sent.
+            failures = {}
+            uvc = vehicle_info.get('uvc') if vehicle_info else None
+            for province, pricing in self._iter_province_pricing(vin_upper, odometer_miles, self.PROVINCES, headers, uvc,
+                                                                 deadline=deadline):
+                if not pricing.get('success'):
+                    failures[province] = pricing
+                    if header is not None:
+                        yield 'province_error', self._build_card(province, header, pricing)
+                    continue
 
-            # Step 1: Get vehicle info from GraphQL (including auction/wholesale data)
-            query = """
-            query GetVehicleInfo($vin: String!) {
-                usedvehicles(vin: $vin) {
-                    error_count
-                    warning_count
-                    message_list {
-                        description
-                        code
-                        type
-                    }
-                    usedvehicles {
-                        uvc
-                        model_year
-                        make
-                        model
-                        publish_date
-                        vin
-                    }
-                }
+                if header is None:
+                    header = self._build_vehicle_header(vin_upper, odometer_km, odometer_miles, pricing.get('raw_data', {}))
+                    yield 'vehicle', header
+                    for failed_province in self.PROVINCES:
+                        if failed_province in failures:
+                            yield 'province_error', self._build_card(failed_province, header, failures[failed_province])
+
+                yield 'card', self._build_card(province, header, pricing)
+
+            if header is None:
+                yield 'error', self._remember_unknown(vin_upper, self._vehicle_lookup_error(self.PROVINCES, failures))
+
+        except requests.exceptions.Timeout:
+            yield 'error', {
+                'success': False,
+                'error': 'Request timeout'
+            }
+        except requests.exceptions.ConnectionError:
+            yield 'error', {
+                'success': False,
+                'error': 'Connection error - unable to reach Blackbook API'
+            }
+        except Exception as e:
+            yield 'error', {
+                'success': False,
+                'error': f'Unexpected error: {str(e)}'
             }
-            """
 
-            variables = {'vin': vin_upper}
+    def _get_async_client(self, headers: Dict[str, str]) -> AsyncBlackbookClient:
+        """Return the gql client for the running event loop, creating it on first use"""
+        client = self._async_client
+        if client is None or client.loop is not asyncio.get_running_loop():
+            if client is not None:
+                client.close_soon()
+            client = self._async_client = AsyncBlackbookClient(self.graphql_url, headers)
+        return client
+
+    async def close_async(self) -> None:
+        """Close the async engine's connections (call on event loop shutdown)"""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+
+    async def fetch_pricing_cards_async(self, vin: str, odometer_km: int) -> Dict[str, Any]:
+        """
+        asyncio variant of fetch_pricing_cards using the gql/aiohttp engine
+
+        Shares validation, caches and response parsing with the sync path.
+        Province calls run on the event loop bounded by max_concurrency
+        instead of on a thread pool; cache reads and writes (SQLite) and the
+        VIN lookup run on the default executor so they never block the loop.
+        """
+        try:
+            invalid = await asyncio.to_thread(self._validate_pricing_request, vin, odometer_km)
+            if invalid:
+                return invalid
 
-            response = requests.post(
-                self.graphql_url,
-                json={
-                    'query': query,
-                    'variables': variables
-                },
-                headers=headers,
-                timeout=15
-            )
+            vin_upper = vin.upper()
+            odometer_miles = self._convert_km_to_miles(odometer_km)
+            headers = self._get_auth_headers()
+            client = self._get_async_client(headers)
 
-            if response.status_code != 200:
-                return {
-                    'success': False,
-                    'error': f'GraphQL API error: {response.status_code}'
-                }
+            # Get pricing for all Canadian provinces concurrently, within the request deadline
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            deadline = time.monotonic() + self.request_deadline
 
-            data = response.json()
+            vehicle_info = await asyncio.to_thread(self._resolve_vehicle, vin_upper)
+            uvc = vehicle_info.get('uvc') if vehicle_info else None
+            cached = await asyncio.to_thread(self._cached_pricing, vin_upper, odometer_miles, self.PROVINCES, uvc)
 
-            if 'errors' in data:
-                return {
-                    'success': False,
-                    'error': f"GraphQL errors: {data['errors']}"
-                }
+            async def fetch_province(province):
+                if province in cached:
+                    return cached[province]
 
-            result = data.get('data', {}).get('usedvehicles', {})
-            error_count = result.get('error_count', 0)
-            vehicles = result.get('usedvehicles', [])
+                started = time.perf_counter()
+                pricing = await fetch_uncached(province)
+                PROVINCE_LATENCY.labels(province, self._pricing_status(pricing)).observe(time.perf_counter() - started)
+                return pricing
 
-            if error_count > 0 or not vehicles:
-                return {
-                    'success': False,
-                    'error': 'No vehicle data found for this VIN'
-                }
+            async def fetch_uncached(province):
+                province_code = self.PROVINCE_CODES.get(province, 'ON')
+
+                async def call():
+                    async with semaphore:
+                        return await self._execute_async(client, 'pricing', self.PROVINCE_PRICING_QUERY, {
+                            'vin': vin_upper,
+                            'mileage': odometer_miles,
+                            'province': province_code
+                        }, hedge=True)
+
+                try:
+                    status, data = await asyncio.wait_for(call(), timeout=self._call_timeout(deadline, 'pricing'))
+                except asyncio.TimeoutError:
+                    return self._timed_out(province)
+                except CircuitOpenError:
+                    return self._unavailable()
+                except Exception as e:
+                    return {
+                        'success': False,
+                        'error': f'Error fetching {province} pricing: {str(e)}'
+                    }
 
-            vehicle_info = vehicles[0]
+                if status != 200:
+                    return {
+                        'success': False,
+                        'error': f'Pricing API error for {province}: {status}'
+                    }
 
-            # Step 2: Get pricing for all Canadian provinces
-            provinces = [
-                'Alberta', 'British Columbia', 'Manitoba', 'New Brunswick',
-                'Newfoundland and Labrador', 'Northwest Territories', 'Nova Scotia',
-                'Nunavut', 'Ontario', 'Prince Edward Island', 'Quebec',
-                'Saskatchewan', 'Yukon'
-            ]
-            cards = []
+                pricing = self._parse_province_response(province, data)
+                if pricing.get('success'):
+                    await asyncio.to_thread(self._store_pricing, vin_upper, odometer_miles, province_code, pricing)
+                return pricing
 
-            for province in provinces:
-                pricing = self._fetch_province_pricing(vin_upper, odometer_miles, province, headers)
-                
-                if not pricing.get('success'):
-                    return pricing  # Return error if any province fails
-
-                card = {
-                    'province': province,
-                    'vin': vin_upper,
-                    'odometer_km': odometer_km,
-                    'odometer_miles': odometer_miles,
-                    'uvc': vehicle_info.get('uvc'),
-                    'year': vehicle_info.get('model_year'),
-                    'make': vehicle_info.get('make'),
-                    'model': vehicle_info.get('model'),
-                    'series': pricing.get('raw_data', {}).get('series', ''),
-                    'style': pricing.get('raw_data', {}).get('style', ''),
-                    'publish_date': vehicle_info.get('publish_date'),
-                    'adjusted_wholesale': pricing.get('adjusted_wholesale'),
-                    'adjusted_retail': pricing.get('adjusted_retail'),
-                    'adjusted_tradein': pricing.get('adjusted_tradein')
-                }
-                cards.append(card)
+            results = dict(zip(self.PROVINCES, await asyncio.gather(*(fetch_province(province) for province in self.PROVINCES))))
+            succeeded = [pricing for pricing in results.values() if pricing.get('success')]
+            if not succeeded:
+                return await asyncio.to_thread(self._remember_unknown, vin_upper,
+                                               self._vehicle_lookup_error(self.PROVINCES, results))
+
+            # Vehicle header from the resolved VIN record, or else from the pricing responses
+            if vehicle_info is None:
+                vehicle_info = succeeded[0].get('raw_data', {})
+            header = self._build_vehicle_header(vin_upper, odometer_km, odometer_miles, vehicle_info)
+            cards = [self._build_card(province, header, pricing) for province, pricing in results.items()]
 
             return {
                 'success': True,
+                'partial': len(succeeded) < len(cards),
                 'cards': cards
             }
 
-        except requests.exceptions.Timeout:
+        except asyncio.TimeoutError:
             return {
                 'success': False,
                 'error': 'Request timeout'
             }
-        except requests.exceptions.ConnectionError:
+        except Exception as e:
             return {
                 'success': False,
-                'error': 'Connection error - unable to reach Blackbook API'
+                'error': f'Unexpected error: {str(e)}'
             }
-        except Exception as e:
+
+    def _validate_pricing_request(self, vin: str, odometer_km: int) -> Optional[Dict[str, Any]]:
+        """Return an error result for an invalid pricing request or a VIN known to be unknown, or None"""
+        if not self.graphql_url:
             return {
                 'success': False,
-                'error': f'Unexpected error: {str(e)}'
+                'error': 'GraphQL URL not configured'
+            }
+
+        if not vin:
+            return {
+                'success': False,
+                'error': 'VIN is required'
+            }
+
+        vin_error = validate_vin(vin)
+        if vin_error:
+            return {
+                'success': False,
+                'invalid': True,
+                'error': vin_error
             }
 
-    def _fetch_province_pricing(self, vin: str, mileage: int, province: str, headers: Dict[str, str]) -> Dict[str, Any]:
+        if not isinstance(odometer_km, int) or odometer_km < 0:
+            return {
+                'success': False,
+                'error': 'Odometer must be a positive number'
+            }
+
+        return self._known_unknown(vin.upper())
+
+    def _known_unknown(self, vin: str) -> Optional[Dict[str, Any]]:
+        """The cached error for a VIN Blackbook recently reported as unknown, or None"""
+        error = self.unknown_vins.get(vin)
+        if error is None:
+            return None
+        return {
+            'success': False,
+            'not_found': True,
+            'error': error
+        }
+
+    def _remember_unknown(self, vin: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Cache a not-found lookup result for the VIN; returns the result unchanged"""
+        if result.get('not_found'):
+            self.unknown_vins.set(vin, result['error'])
+        return result
+
+    def _build_vehicle_header(self, vin: str, odometer_km: int, odometer_miles: int, vehicle_info: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'vin': vin,
+            'odometer_km': odometer_km,
+            'odometer_miles': odometer_miles,
+            'uvc': vehicle_info.get('uvc'),
+            'year': vehicle_info.get('model_year'),
+            'make': vehicle_info.get('make'),
+            'model': vehicle_info.get('model'),
+            'publish_date': vehicle_info.get('publish_date')
+        }
+
+    def _build_card(self, province: str, header: Dict[str, Any], pricing: Dict[str, Any]) -> Dict[str, Any]:
+        """Pricing card for a province; failed provinces get status 'error' or 'timeout' and no values"""
+        card = {
+            'province': province,
+            'status': self._pricing_status(pricing),
+            'vin': header['vin'],
+            'odometer_km': header['odometer_km'],
+            'odometer_miles': header['odometer_miles'],
+            'uvc': header['uvc'],
+            'year': header['year'],
+            'make': header['make'],
+            'model': header['model'],
+            'series': pricing.get('raw_data', {}).get('series', ''),
+            'style': pricing.get('raw_data', {}).get('style', ''),
+            'publish_date': header['publish_date'],
+            'adjusted_wholesale': pricing.get('adjusted_wholesale'),
+            'adjusted_retail': pricing.get('adjusted_retail'),
+            'adjusted_tradein': pricing.get('adjusted_tradein')
+        }
+        if not pricing.get('success'):
+            card['error'] = pricing.get('error')
+        return card
+
+    @staticmethod
+    def _pricing_status(pricing: Dict[str, Any]) -> str:
+        return 'ok' if pricing.get('success') else ('timeout' if pricing.get('timed_out') else 'error')
+
+    def _remember_vehicle(self, vin: str, vehicle_info: Dict[str, Any]) -> None:
+        """Cache the VIN -> uvc/year/make/model/publish_date record and index its squish"""
+        record = {
+            'vin': vin,
+            'uvc': vehicle_info.get('uvc'),
+            'model_year': vehicle_info.get('model_year'),
+            'make': vehicle_info.get('make'),
+            'model': vehicle_info.get('model'),
+            'publish_date': vehicle_info.get('publish_date')
+        }
+        self.vehicle_cache.set(vin, record)
+
+        squish = vin_squish(vin)
+        if not record['uvc'] or squish is None:
+            return
+
+        entry = self.squish_index.get(squish)
+        if entry is None or (entry.get('uvc') == record['uvc'] and
+                             entry['vehicle'].get('publish_date') != record['publish_date']):
+            self.squish_index.set(squish, {'uvc': record['uvc'], 'vehicle': record})
+        elif not entry.get('ambiguous') and entry.get('uvc') != record['uvc']:
+            # Same pattern, different UVCs: VINs of this squish must be resolved individually
+            self.squish_index.set(squish, {'ambiguous': True})
+
+    def _resolve_vehicle(self, vin: str) -> Optional[Dict[str, Any]]:
+        """Vehicle record for a VIN from the VIN cache, or from another VIN with the same squish"""
+        record = self.vehicle_cache.get(vin)
+        if record is not None:
+            return record
+
+        squish = vin_squish(vin)
+        entry = self.squish_index.get(squish) if squish is not None else None
+        if entry is None or entry.get('ambiguous'):
+            return None
+        return {**entry['vehicle'], 'vin': vin}
+
+    def _vehicle_lookup_error(self, provinces: List[str], results: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Request-level error when no province returned pricing for the VIN"""
+        if results and all(pricing.get('timed_out') for pricing in results.values()):
+            return {
+                'success': False,
+                'error': 'Request timeout'
+            }
+
+        if results and any(pricing.get('unavailable') for pricing in results.values()):
+            return self._unavailable()
+
+        # Marked not_found (and so remembered as unknown) only when every
+        # province rejected the VIN itself, not when some failed transiently
+        not_found = bool(provinces) and all(results.get(province, {}).get('not_found') for province in provinces)
+
+        for province in provinces:
+            pricing = results.get(province, {})
+            if pricing.get('messages'):
+                error = {
+                    'success': False,
+                    'error': pricing['error']
+                }
+                if not_found:
+                    error['not_found'] = True
+                return error
+
+        if not_found:
+            return {
+                'success': False,
+                'not_found': True,
+                'error': 'No vehicle data found for this VIN'
+            }
+
+        for province in provinces:
+            if province in results:
+                return {
+                    'success': False,
+                    'error': results[province].get('error')
+                }
+
+        return {
+            'success': False,
+            'error': 'No vehicle data found for this VIN'
+        }
+
+    def _iter_province_pricing(self, vin: str, mileage: int, provinces: List[str], headers: Dict[str, str],
+                               uvc: Optional[str] = None, use_cache: bool = True,
+                               deadline: Optional[float] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Yield (province, pricing) pairs as each province becomes available
+
+        Pricing is cached per (uvc, mileage, province): Blackbook adjusts
+        prices mile by mile, so another VIN of a known UVC is served from
+        cache only at exactly the same mileage. Cached provinces come
+        first (stale ones are refreshed in the background); the rest are
+        fetched concurrently (one call per province, or aliased batches in
+        batch mode) and yielded in completion order. use_cache=False
+        refetches every province.
+
+        With a deadline (a time.monotonic() value) each call gets the time
+        left as its timeout, and provinces still outstanding at the deadline
+        are yielded as timed out. Their calls keep running in the background
+        and still fill the cache when they complete.
+        """
+        code = lambda province: self.PROVINCE_CODES.get(province, 'ON')
+        # In-flight lookups are keyed by UVC when it is known, else by VIN
+        flight_key = lambda province: (uvc or vin, mileage, code(province))
+
+        def lookup(key):
+            known_uvc = uvc
+            if known_uvc is None:
+                record = self.vehicle_cache.get(vin)
+                known_uvc = record.get('uvc') if record else None
+            pricing = self.pricing_cache.get((known_uvc, mileage, key[2])) if known_uvc else None
+            # Only a fresh entry means the other worker's refresh has landed
+            return None if pricing is None or self._is_stale(pricing) else pricing
+
+        cached = self._cached_pricing(vin, mileage, provinces, uvc) if use_cache else {}
+        for province, pricing in cached.items():
+            yield province, pricing
+
+        missing = [province for province in provinces if province not in cached]
+        if not missing:
+            return
+
+        if self.batch_provinces and len(missing) > 1:
+            size = self.batch_size
+            chunks = [missing[i:i + size] for i in range(0, len(missing), size)]
+        else:
+            chunks = [[province] for province in missing]
+
+        def fetch_chunk(chunk):
+            key_provinces = {flight_key(province): province for province in chunk}
+
+            def fetch(keys):
+                fetched = {}
+                pending = [key_provinces[key] for key in keys]
+                started = time.perf_counter()
+                results = self._fetch_province_chunk(vin, mileage, pending, headers, deadline)
+                elapsed = time.perf_counter() - started
+                for key, pricing in zip(keys, results):
+                    fetched[key] = pricing
+                    PROVINCE_LATENCY.labels(key_provinces[key], self._pricing_status(pricing)).observe(elapsed)
+                    if pricing.get('success'):
+                        self._store_pricing(vin, mileage, key[2], pricing)
+                return fetched
+
+            # Identical (UVC or VIN, mileage, province) lookups already in flight are shared
+            fetched = self.pricing_inflight.do_many(list(key_provinces), fetch, lookup)
+            return [(province, fetched[key]) for key, province in key_provinces.items()]
+
+        workers = min(self.max_concurrency, len(chunks))
+        if workers <= 1 and deadline is None:
+            for chunk in chunks:
+                yield from fetch_chunk(chunk)
+            return
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='blackbook-province')
+        try:
+            # Each call runs in the caller's priority lane
+            futures = {executor.submit(contextvars.copy_context().run, fetch_chunk, chunk): chunk for chunk in chunks}
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            finished = set()
+            try:
+                for future in as_completed(futures, timeout=remaining):
+                    finished.add(future)
+                    yield from future.result()
+            except FuturesTimeoutError:
+                for future, chunk in futures.items():
+                    if future in finished:
+                        continue
+                    if future.done():
+                        yield from future.result()
+                    else:
+                        for province in chunk:
+                            yield province, self._timed_out(province)
+        finally:
+            # Don't block a consumer that stopped early on calls still in flight
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _cached_pricing(self, vin: str, mileage: int, provinces: List[str], uvc: Optional[str]) -> Dict[str, Dict[str, Any]]:
+        """Cached pricing by province for a known UVC, scheduling a background refresh of stale entries"""
+        if not uvc:
+            return {}
+
+        cached = {}
+        for province in provinces:
+            pricing = self.pricing_cache.get((uvc, mileage, self.PROVINCE_CODES.get(province, 'ON')))
+            if pricing is not None:
+                cached[province] = pricing
+
+        stale = [province for province, pricing in cached.items() if self._is_stale(pricing)]
+        if stale:
+            self._schedule_refresh(vin, mileage, uvc, stale)
+        return cached
+
+    def _store_pricing(self, vin: str, mileage: int, province_code: str, pricing: Dict[str, Any]) -> None:
+        """Cache a successful province pricing at UVC level and remember the VIN's vehicle record"""
+        raw_data = pricing.get('raw_data', {})
+        self._note_publish_date(raw_data.get('publish_date'))
+        if not raw_data.get('uvc'):
+            return
+
+        record = self.vehicle_cache.get(vin)
+        if record is None or record.get('publish_date') != raw_data.get('publish_date'):
+            self._remember_vehicle(vin, raw_data)
+        self.pricing_cache.set((raw_data['uvc'], mileage, province_code), {**pricing, 'cached_at': time.time()})
+
+    def _operation_timeout(self, operation: str) -> float:
+        """Timeout for one call: a multiple of the operation's recent p99, within MIN_CALL_TIMEOUT..CALL_TIMEOUT"""
+        if self.adaptive_timeouts:
+            p99 = self.latency.percentile(operation, 99)
+            if p99 is not None:
+                return min(self.CALL_TIMEOUT, max(self.MIN_CALL_TIMEOUT, p99 * self.timeout_multiplier))
+        return self.CALL_TIMEOUT
+
+    def _call_timeout(self, deadline: Optional[float], operation: str = 'pricing') -> float:
+        """Timeout for the next call: the operation timeout, cut to the time left before the deadline"""
+        timeout = self._operation_timeout(operation)
+        if deadline is None:
+            return timeout
+        return max(0.0, min(timeout, deadline - time.monotonic()))
+
+    def _hedge_delay(self, operation: str, timeout: float) -> Optional[float]:
+        """How long to wait before hedging a call, or None when it should not be hedged"""
+        if not self.hedging:
+            return None
+        delay = self.latency.percentile(operation, self.hedge_percentile)
+        if delay is None or delay >= timeout:
+            return None
+        return delay
+
+    def _get_hedge_executor(self) -> Tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+        """The hedging pool and a semaphore counting its free threads"""
+        with self._hedge_lock:
+            # Threads don't survive a fork - start a fresh pool in each worker
+            if self._hedge_executor is None or self._hedge_executor_pid != os.getpid():
+                workers = int(os.getenv('BLACKBOOK_HEDGE_WORKERS', '32'))
+                self._hedge_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='blackbook-hedge')
+                self._hedge_slots = threading.BoundedSemaphore(workers)
+                self._hedge_executor_pid = os.getpid()
+            return self._hedge_executor, self._hedge_slots
+
+    def _timed_post(self, operation: str, payload: Dict[str, Any], headers: Dict[str, str], timeout: float) -> requests.Response:
+        """
+        One call through the Blackbook rate limiter and circuit breaker, recording the latency of each attempt
+
+        Every attempt (retries and hedges included) spends a token in the
+        current lane. Time spent waiting for it comes out of the timeout.
+        """
+        def attempt():
+            waited = self.rate_limiter.acquire(timeout=timeout)
+            started = time.monotonic()
+            try:
+                response = get_session('blackbook').post(self.graphql_url, json=payload, headers=headers,
+                                                         timeout=max(0.001, timeout - waited))
+            except requests.exceptions.Timeout:
+                # A timed-out call still tells us latency is at least this high
+                self.latency.record(operation, time.monotonic() - started)
+                raise
+            if response.status_code == 200:
+                self.latency.record(operation, time.monotonic() - started)
+            return response
+
+        return call_upstream('blackbook', attempt)
+
+    def _post(self, operation: str, payload: Dict[str, Any], headers: Dict[str, str], timeout: float,
+              hedge: bool = False) -> requests.Response:
+        """
+        POST a GraphQL document to Blackbook, recording its latency
+
+        With hedge=True, a call still running after the operation's hedge
+        percentile gets a duplicate (if the hedge budget allows) and the
+        first successful answer wins; the slower call finishes in the
+        background. Both attempts need a free thread in the hedging pool -
+        nothing ever queues for one. A call finding the pool busy runs
+        unhedged in the calling thread, and a hedge that cannot get a
+        thread is skipped.
+        """
+        delay = self._hedge_delay(operation, timeout) if hedge else None
+        if hedge:
+            self.hedge_budget.note_call()
+        if delay is None:
+            return self._timed_post(operation, payload, headers, timeout)
+
+        executor, slots = self._get_hedge_executor()
+
+        def submit(call_timeout: float):
+            future = executor.submit(contextvars.copy_context().run, self._timed_post, operation, payload, headers,
+                                     call_timeout)
+            future.add_done_callback(lambda _: slots.release())
+            return future
+
+        if not slots.acquire(blocking=False):
+            return self._timed_post(operation, payload, headers, timeout)
+        primary = submit(timeout)
+        try:
+            return primary.result(timeout=delay)
+        except FuturesTimeoutError:
+            pass
+
+        if not slots.acquire(blocking=False):
+            return primary.result()
+        if not self.hedge_budget.spend():
+            slots.release()
+            return primary.result()
+
+        hedged = submit(max(timeout - delay, self.MIN_CALL_TIMEOUT))
+        response = None
+        error = None
+        for future in as_completed([primary, hedged]):
+            try:
+                result = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if result.status_code == 200:
+                if future is hedged:
+                    self.hedge_budget.note_win()
+                return result
+            response = response or result
+
+        if response is not None:
+            return response
+        raise error
+
+    async def _execute_async(self, client: AsyncBlackbookClient, operation: str, query: str,
+                             variables: Dict[str, Any], hedge: bool = False) -> Tuple[int, Dict[str, Any]]:
+        """asyncio counterpart of _post: time the call and hedge it past the hedge percentile"""
+        async def attempt():
+            await self.rate_limiter.acquire_async()
+            started = time.monotonic()
+            status, data = await client.execute(query, variables)
+            if status == 200:
+                self.latency.record(operation, time.monotonic() - started)
+            return status, data
+
+        def timed():
+            return call_upstream_async('blackbook', attempt)
+
+        delay = self._hedge_delay(operation, self._operation_timeout(operation)) if hedge else None
+        if hedge:
+            self.hedge_budget.note_call()
+        if delay is None:
+            return await timed()
+
+        primary = asyncio.ensure_future(timed())
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.hedge_budget.spend():
+            return await primary
+
+        hedged = asyncio.ensure_future(timed())
+        pending = {primary, hedged}
+        result = None
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    if task.result()[0] == 200:
+                        if task is hedged:
+                            self.hedge_budget.note_win()
+                        return task.result()
+                    result = result or task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if result is not None:
+            return result
+        raise error
+
+    @staticmethod
+    def _timed_out(province: str) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'timed_out': True,
+            'error': f'{province} pricing timed out'
+        }
+
+    @staticmethod
+    def _unavailable() -> Dict[str, Any]:
+        """Result for a call skipped because the Blackbook circuit breaker is open"""
+        return {
+            'success': False,
+            'unavailable': True,
+            'error': 'Blackbook API temporarily unavailable - please try again shortly'
+        }
+
+    def _fetch_province_chunk(self, vin: str, mileage: int, provinces: List[str], headers: Dict[str, str],
+                              deadline: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Fetch pricing for a chunk of provinces, splitting it if upstream rejects the document"""
+        if len(provinces) == 1:
+            return [self._fetch_province_pricing(vin, mileage, provinces[0], headers, deadline)]
+
+        results = self._fetch_province_pricing_batch(vin, mileage, provinces, headers, deadline)
+        if results is not None:
+            # Transient failures (5xx, timeouts) say nothing about the size upstream takes
+            if any(pricing.get('success') or pricing.get('not_found') for pricing in results):
+                self._note_batch_size(len(provinces), accepted=True)
+            return results
+
+        # Upstream refused the document - retry in halves
+        self._note_batch_size(len(provinces), accepted=False)
+        half = (len(provinces) + 1) // 2
+        return (self._fetch_province_chunk(vin, mileage, provinces[:half], headers, deadline) +
+                self._fetch_province_chunk(vin, mileage, provinces[half:], headers, deadline))
+
+    def _note_batch_size(self, size: int, accepted: bool) -> None:
+        """
+        Adjust batch_size after upstream accepted or rejected a document of `size` provinces
+
+        batch_size is the largest size accepted below the smallest rejected
+        one (half the rejected size until one is). After batch_probe_after
+        accepted batches, or batch_probe_interval seconds, since the last
+        rejection, the rejection is forgotten and one size larger is tried.
+        """
+        with self._batch_lock:
+            if accepted:
+                if self._batch_rejected is None or size < self._batch_rejected:
+                    self._batch_accepted = max(self._batch_accepted, size)
+                self._batch_successes += 1
+                if self._batch_rejected is not None and (
+                        self._batch_successes >= self.batch_probe_after or
+                        time.monotonic() - self._batch_rejected_at >= self.batch_probe_interval):
+                    self._batch_rejected = None
+            else:
+                if self._batch_accepted >= size:
+                    # Accepted before, rejected now: what upstream takes is unknown again
+                    self._batch_accepted = 0
+                if self._batch_rejected is None or size < self._batch_rejected:
+                    self._batch_rejected = size
+                self._batch_rejected_at = time.monotonic()
+                self._batch_successes = 0
+
+            if self._batch_rejected is None:
+                self.batch_size = min(self.max_batch_size, self._batch_accepted + 1)
+            else:
+                self.batch_size = self._batch_accepted or max(1, (self._batch_rejected + 1) // 2)
+
+    def _fetch_province_pricing_batch(self, vin: str, mileage: int, provinces: List[str], headers: Dict[str, str],
+                                      deadline: Optional[float] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Fetch pricing for several provinces with one aliased GraphQL document
+
+        Returns None only when upstream rejects the document for its size
+        (HTTP 413, or GraphQL errors about complexity, depth or limits and no
+        data), so the caller can fall back to smaller batches. Any other
+        failure is returned as an error for every province in the batch.
+        """
+        timeout = self._call_timeout(deadline, 'pricing_batch')
+        if timeout <= 0:
+            return [self._timed_out(province) for province in provinces]
+
+        aliases = {f"p_{self.PROVINCE_CODES.get(province, 'ON')}_{index}": province
+                   for index, province in enumerate(provinces)}
+        fields = ''.join(
+            f"""
+                {alias}: usedvehicles(vin: $vin, mileage: $mileage, province: "{self.PROVINCE_CODES.get(province, 'ON')}") {{
+                    {self.PRICING_FIELDS}
+                }}"""
+            for alias, province in aliases.items()
+        )
+        query = f"""
+            query GetPricingBatch($vin: String!, $mileage: Int!) {{{fields}
+            }}
+            """
+
+        try:
+            response = self._post('pricing_batch', {
+                'query': query,
+                'variables': {'vin': vin, 'mileage': mileage}
+            }, headers, timeout, hedge=True)
+
+            if response.status_code == 413:
+                return None
+
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+        except requests.exceptions.Timeout:
+            return [self._timed_out(province) for province in provinces]
+        except CircuitOpenError:
+            return [self._unavailable() for province in provinces]
+        except Exception as e:
+            return [{
+                'success': False,
+                'error': f'Error fetching {province} pricing: {str(e)}'
+            } for province in provinces]
+
+        data = data if isinstance(data, dict) else {}
+        results = data.get('data') or {}
+        errors = data.get('errors') or []
+        if not results and any(self.DOCUMENT_REJECTED_PATTERN.search(str(error.get('message', '')))
+                               for error in errors if isinstance(error, dict)):
+            return None
+
+        if response.status_code != 200:
+            return [{
+                'success': False,
+                'error': f'Pricing API error for {province}: {response.status_code}'
+            } for province in provinces]
+
+        if not results:
+            return [{
+                'success': False,
+                'error': f"Pricing API errors for {province}: {errors or 'empty response'}"
+            } for province in provinces]
+
+        pricing = []
+        for alias, province in aliases.items():
+            result = results.get(alias)
+            if result is None:
+                alias_errors = [error for error in errors if alias in (error.get('path') or [])] or errors
+                pricing.append({
+                    'success': False,
+                    'error': f"Pricing API errors for {province}: {alias_errors}"
+                })
+            else:
+                pricing.append(self._parse_province_result(province, result))
+        return pricing
+
+    def _fetch_province_pricing(self, vin: str, mileage: int, province: str, headers: Dict[str, str],
+                                deadline: Optional[float] = None) -> Dict[str, Any]:
         """Fetch pricing data for a specific province"""
         try:
             if not self.graphql_url:
@@ -459,46 +1403,12 @@ class BlackbookService:
                     'success': False,
                     'error': 'GraphQL URL not configured'
                 }
-            
-            # Province code mapping for all Canadian provinces and territories
-            province_codes = {
-                'Alberta': 'AB',
-                'British Columbia': 'BC',
-                'Manitoba': 'MB',
-                'New Brunswick': 'NB',
-                'Newfoundland and Labrador': 'NL',
-                'Northwest Territories': 'NT',
-                'Nova Scotia': 'NS',
-                'Nunavut': 'NU',
-                'Ontario': 'ON',
-                'Prince Edward Island': 'PE',
-                'Quebec': 'QC',
-                'Saskatchewan': 'SK',
-                'Yukon': 'YT'
-            }
-            
-            province_code = province_codes.get(province, 'ON')
 
-            query = """
-            query GetPricing($vin: String!, $mileage: Int!, $province: String!) {
-                usedvehicles(vin: $vin, mileage: $mileage, province: $province) {
-                    usedvehicles {
-                        vin
-                        model_year
-                        make
-                        model
-                        series
-                        style
-                        uvc
-                        publish_date
-                        description_score
-                        adjusted_whole_rough
-                        adjusted_retail_rough
-                        adjusted_tradein_rough
-                    }
-                }
-            }
-            """
+            timeout = self._call_timeout(deadline, 'pricing')
+            if timeout <= 0:
+                return self._timed_out(province)
+
+            province_code = self.PROVINCE_CODES.get(province, 'ON')
 
             variables = {
                 'vin': vin,
@@ -506,15 +1416,10 @@ class BlackbookService:
                 'province': province_code
             }
 
-            response = requests.post(
-                self.graphql_url,
-                json={
-                    'query': query,
-                    'variables': variables
-                },
-                headers=headers,
-                timeout=15
-            )
+            response = self._post('pricing', {
+                'query': self.PROVINCE_PRICING_QUERY,
+                'variables': variables
+            }, headers, timeout, hedge=True)
 
             if response.status_code != 200:
                 return {
@@ -522,36 +1427,58 @@ class BlackbookService:
                     'error': f'Pricing API error for {province}: {response.status_code}'
                 }
 
-            data = response.json()
+            return self._parse_province_response(province, response.json())
 
-            if 'errors' in data:
-                return {
-                    'success': False,
-                    'error': f"Pricing API errors for {province}: {data['errors']}"
-                }
+        except requests.exceptions.Timeout:
+            return self._timed_out(province)
+        except CircuitOpenError:
+            return self._unavailable()
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'Error fetching {province} pricing: {str(e)}'
+            }
 
-            result = data.get('data', {}).get('usedvehicles', {})
-            vehicles = result.get('usedvehicles', [])
+    def _parse_province_response(self, province: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn a GetPricing response into a province pricing dict"""
+        if 'errors' in data:
+            return {
+                'success': False,
+                'error': f"Pricing API errors for {province}: {data['errors']}"
+            }
 
-            if not vehicles:
-                return {
-                    'success': False,
-                    'error': f'No pricing data found for {province}'
-                }
+        result = data.get('data', {}).get('usedvehicles', {})
+        return self._parse_province_result(province, result)
 
-            pricing_data = vehicles[0]
+    def _parse_province_result(self, province: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn one `usedvehicles` pricing result into a province pricing dict"""
+        vehicles = result.get('usedvehicles', [])
 
-            # Return raw rough condition pricing from Blackbook
+        if result.get('error_count', 0) > 0:
+            # VIN validation errors reported by Blackbook in message_list
+            messages = [msg.get('description', '') for msg in result.get('message_list') or []
+                        if (msg.get('type') or '').lower() == 'error']
             return {
-                'success': True,
-                'adjusted_wholesale': pricing_data.get('adjusted_whole_rough'),
-                'adjusted_retail': pricing_data.get('adjusted_retail_rough'),
-                'adjusted_tradein': pricing_data.get('adjusted_tradein_rough'),
-                'raw_data': pricing_data  # Include all raw data
+                'success': False,
+                'not_found': True,
+                'messages': messages,
+                'error': ', '.join(messages) if messages else 'No vehicle data found for this VIN'
             }
 
-        except Exception as e:
+        if not vehicles:
             return {
                 'success': False,
-                'error': f'Error fetching {province} pricing: {str(e)}'
-            }
\ No newline at end of file
+                'not_found': True,
+                'error': f'No pricing data found for {province}'
+            }
+
+        pricing_data = vehicles[0]
+
+        # Return raw rough condition pricing from Blackbook
+        return {
+            'success': True,
+            'adjusted_wholesale': pricing_data.get('adjusted_whole_rough'),
+            'adjusted_retail': pricing_data.get('adjusted_retail_rough'),
+            'adjusted_tradein': pricing_data.get('adjusted_tradein_rough'),
+            'raw_data': pricing_data  # Include all raw data
+        }
\ No newline at end of file
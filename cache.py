@@ -0,0 +1,456 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from metrics import CACHE_LOOKUPS
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache with per-entry TTL and LRU eviction
+
+    Entries expire `ttl` seconds after they were stored. When the cache is
+    full the least recently used entry is evicted to make room. Lookups are
+    counted in the cache_lookups_total metric when a namespace is given.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, namespace: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lookups = None
+        if namespace:
+            self._lookups = {result: CACHE_LOOKUPS.labels(namespace, result) for result in ('hit', 'miss')}
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._get(key)
+        if self._lookups is not None:
+            self._lookups['miss' if value is _MISSING else 'hit'].inc()
+        return default if value is _MISSING else value
+
+    def _get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if not self.enabled:
+            return
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Remove every entry for which predicate(key, value) is true"""
+        with self._lock:
+            stale = [key for key, (value, _) in self._entries.items() if predicate(key, value)]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def popular(self, predicate: Callable[[Hashable, Any], bool], limit: int) -> List[tuple]:
+        """Most recently used (key, value) pairs for which predicate(key, value) is true"""
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.items())
+        found = []
+        for key, (value, expires_at) in reversed(entries):
+            if len(found) >= limit:
+                break
+            if expires_at > now and predicate(key, value):
+                found.append((key, value))
+        return found
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class SQLiteCache:
+    """
+    Cache stored in a SQLite database shared by every worker process on a node
+
+    The database runs in WAL mode so readers never block the writer. Each
+    namespace is limited to `max_entries` rows; expired rows and the least
+    recently used rows beyond the limit are pruned periodically. Keys and
+    values must be JSON-serialisable.
+    """
+
+    PRUNE_EVERY = 100  # writes between prune passes in this process
+    TOUCH_INTERVAL = 60  # seconds between access-time updates for a hot row
+
+    def __init__(self, path: str, namespace: str, max_entries: int = 50000, ttl: float = 3600):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS locks (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening a new one after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _encode_key(key: Hashable) -> str:
+        return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def get_entry(self, key: Hashable) -> Optional[tuple]:
+        """Return (value, seconds until expiry) for a live entry, or None"""
+        try:
+            conn = self._connect()
+            now = time.time()
+            encoded = self._encode_key(key)
+            row = conn.execute(
+                "SELECT value, expires_at, accessed_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, encoded)
+            ).fetchone()
+
+            if row is None or row[1] <= now:
+                self.misses += 1
+                return None
+
+            if now - row[2] > self.TOUCH_INTERVAL:
+                conn.execute(
+                    "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    (now, self.namespace, encoded)
+                )
+            self.hits += 1
+            return json.loads(row[0]), row[1] - now
+        except sqlite3.Error:
+            self.errors += 1
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if not self.enabled:
+            return
+
+        try:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, self._encode_key(key), json.dumps(value), now + (self.ttl if ttl is None else ttl), now)
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self.prune()
+        except sqlite3.Error:
+            self.errors += 1
+
+    def delete(self, key: Hashable) -> None:
+        try:
+            self._connect().execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, self._encode_key(key))
+            )
+        except sqlite3.Error:
+            self.errors += 1
+
+    def prune(self) -> int:
+        """Delete expired rows and the least recently used rows beyond max_entries"""
+        conn = self._connect()
+        removed = conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND expires_at <= ?",
+            (self.namespace, time.time())
+        ).rowcount
+        evicted = conn.execute("""
+            DELETE FROM cache WHERE namespace = ? AND key IN (
+                SELECT key FROM cache WHERE namespace = ?
+                ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.namespace, self.namespace, self.max_entries)).rowcount
+        self.evictions += evicted
+        return removed + evicted
+
+    def invalidate(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Remove every entry for which predicate(key, value) is true"""
+        try:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT key, value FROM cache WHERE namespace = ?",
+                (self.namespace,)
+            ).fetchall()
+            stale = []
+            for encoded, value in rows:
+                key = json.loads(encoded)
+                if predicate(tuple(key) if isinstance(key, list) else key, json.loads(value)):
+                    stale.append((self.namespace, encoded))
+            conn.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", stale)
+            return len(stale)
+        except sqlite3.Error:
+            self.errors += 1
+            return 0
+
+    def popular(self, predicate: Callable[[Hashable, Any], bool], limit: int) -> List[tuple]:
+        """Most recently used (key, value) pairs for which predicate(key, value) is true"""
+        found = []
+        try:
+            rows = self._connect().execute(
+                "SELECT key, value FROM cache WHERE namespace = ? AND expires_at > ? ORDER BY accessed_at DESC",
+                (self.namespace, time.time())
+            )
+            for encoded, value in rows:
+                if len(found) >= limit:
+                    break
+                key = json.loads(encoded)
+                key = tuple(key) if isinstance(key, list) else key
+                value = json.loads(value)
+                if predicate(key, value):
+                    found.append((key, value))
+        except sqlite3.Error:
+            self.errors += 1
+        return found
+
+    def _lock_name(self, key: Hashable) -> str:
+        return f'{self.namespace}:{self._encode_key(key)}'
+
+    def acquire_lock(self, key: Hashable, owner: str, ttl: float) -> bool:
+        """Take a cross-process lock on a key; returns False if another owner holds it"""
+        try:
+            conn = self._connect()
+            name = self._lock_name(key)
+            now = time.time()
+            conn.execute("DELETE FROM locks WHERE name = ? AND expires_at <= ?", (name, now))
+            return conn.execute(
+                "INSERT OR IGNORE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, owner, now + ttl)
+            ).rowcount == 1
+        except sqlite3.Error:
+            # Without the shared store, proceed as if the lock were ours
+            self.errors += 1
+            return True
+
+    def release_lock(self, key: Hashable, owner: str) -> None:
+        try:
+            self._connect().execute(
+                "DELETE FROM locks WHERE name = ? AND owner = ?",
+                (self._lock_name(key), owner)
+            )
+        except sqlite3.Error:
+            self.errors += 1
+
+    def is_locked(self, key: Hashable) -> bool:
+        try:
+            return self._connect().execute(
+                "SELECT 1 FROM locks WHERE name = ? AND expires_at > ?",
+                (self._lock_name(key), time.time())
+            ).fetchone() is not None
+        except sqlite3.Error:
+            self.errors += 1
+            return False
+
+    def clear(self) -> None:
+        try:
+            self._connect().execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error:
+            self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            size = self._connect().execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            size = None
+        lookups = self.hits + self.misses
+        return {
+            'path': self.path,
+            'size': size,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions,
+            'errors': self.errors
+        }
+
+
+class TieredCache:
+    """In-process TTLCache in front of a shared SQLiteCache"""
+
+    def __init__(self, memory: TTLCache, shared: SQLiteCache):
+        self.memory = memory
+        self.shared = shared
+        self._lookups = {result: CACHE_LOOKUPS.labels(shared.namespace, result)
+                         for result in ('memory_hit', 'shared_hit', 'miss')}
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.enabled or self.shared.enabled
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.memory.get(key)
+        if value is not None:
+            self._lookups['memory_hit'].inc()
+            return value
+
+        entry = self.shared.get_entry(key)
+        if entry is None:
+            self._lookups['miss'].inc()
+            return default
+
+        value, remaining = entry
+        self.memory.set(key, value, min(remaining, self.memory.ttl))
+        self._lookups['shared_hit'].inc()
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self.memory.set(key, value, ttl)
+        self.shared.set(key, value, ttl)
+
+    def delete(self, key: Hashable) -> None:
+        self.memory.delete(key)
+        self.shared.delete(key)
+
+    def invalidate(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        self.memory.invalidate(predicate)
+        return self.shared.invalidate(predicate)
+
+    def popular(self, predicate: Callable[[Hashable, Any], bool], limit: int) -> List[tuple]:
+        return self.shared.popular(predicate, limit)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.shared.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'memory': self.memory.stats(),
+            'shared': self.shared.stats()
+        }
+
+
+def shared_cache_path() -> str:
+    """
+    SQLite file shared by all workers on the node, or '' for in-process only
+
+    Set with SHARED_CACHE_PATH (default: blackbook_cache.sqlite3 in the
+    system temp directory).
+    """
+    return os.getenv('SHARED_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'blackbook_cache.sqlite3'))
+
+
+def create_cache(namespace: str, max_entries: int, ttl: float):
+    """
+    Build the cache for a namespace from the environment
+
+    Caches are kept in the shared_cache_path() file behind an in-process
+    tier; set SHARED_CACHE_PATH to an empty string to keep them in process
+    only. SHARED_CACHE_MAX_ENTRIES limits each namespace on disk (default 50000).
+    """
+    path = shared_cache_path()
+    if not path:
+        return TTLCache(max_entries=max_entries, ttl=ttl, namespace=namespace)
+
+    memory = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    try:
+        shared = SQLiteCache(
+            path,
+            namespace,
+            max_entries=int(os.getenv('SHARED_CACHE_MAX_ENTRIES', '50000')),
+            ttl=ttl
+        )
+    except (sqlite3.Error, OSError):
+        return TTLCache(max_entries=max_entries, ttl=ttl, namespace=namespace)
+
+    return TieredCache(memory, shared)
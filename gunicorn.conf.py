@@ -0,0 +1,39 @@
+"""
+gunicorn settings: threaded workers, and Prometheus metrics across workers
+
+gunicorn reads this file from the working directory, so the deployment's
+command-line options (bind, workers, timeout) still apply.
+
+Workers are threaded (gthread, GUNICORN_THREADS per worker, default 8). A
+long NDJSON batch or SSE stream then holds one thread rather than one of
+the two workers. The worker's heartbeat comes from its main loop rather
+than from the request, so such a stream is not killed at --timeout.
+
+Each worker writes its metric samples to files in PROMETHEUS_MULTIPROC_DIR,
+which /metrics aggregates. The directory is emptied when gunicorn starts,
+so a restart begins with fresh counters. A worker's live gauges
+(in-progress requests, in-flight upstream calls) are dropped when it exits.
+"""
+
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'blackbook_metrics'))
+
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+
+def on_starting(server):
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,128 @@
+"""
+Shared keep-alive HTTP sessions for upstream APIs
+
+Each worker process keeps one pooled `requests.Session` per upstream
+(Blackbook, NHTSA, AutoTrader) so TCP+TLS connections are reused across
+calls instead of being re-established every time.
+
+Settings are read from the environment, per upstream first and then
+globally, e.g. BLACKBOOK_POOL_MAXSIZE falls back to HTTP_POOL_MAXSIZE:
+    *_POOL_CONNECTIONS  number of host pools to keep (default 4)
+    *_POOL_MAXSIZE      connections kept alive per host (default 20)
+    *_TCP_KEEPALIVE     enable TCP keep-alive probes (default true)
+
+The adapter only retries a failed connect once, immediately (e.g. a pooled
+socket the server already closed). Retries of connection errors and 5xx
+responses are budgeted and backed off in resilience.call_upstream.
+"""
+
+import os
+import socket
+import threading
+from typing import Dict, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+from metrics import UPSTREAM_POOL_MAXSIZE
+
+_lock = threading.Lock()
+_sessions: Dict[str, requests.Session] = {}
+_owner_pid = None
+
+
+def upstream_setting(upstream: str, name: str, default: str) -> str:
+    """Read {UPSTREAM}_{name} from the environment, falling back to HTTP_{name}"""
+    return os.getenv(f'{upstream.upper()}_{name}', os.getenv(f'HTTP_{name}', default))
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that optionally enables TCP keep-alive on pooled sockets"""
+
+    def __init__(self, tcp_keepalive: bool = True, **kwargs):
+        self.tcp_keepalive = tcp_keepalive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _create_session(upstream: str) -> requests.Session:
+    retry = Retry(
+        total=1,
+        connect=1,
+        read=0,
+        status=0,
+        raise_on_status=False
+    )
+    pool_maxsize = int(upstream_setting(upstream, 'POOL_MAXSIZE', '20'))
+    adapter = _KeepAliveAdapter(
+        tcp_keepalive=upstream_setting(upstream, 'TCP_KEEPALIVE', 'true').lower() in ('1', 'true', 'yes'),
+        pool_connections=int(upstream_setting(upstream, 'POOL_CONNECTIONS', '4')),
+        pool_maxsize=pool_maxsize,
+        max_retries=retry
+    )
+    UPSTREAM_POOL_MAXSIZE.labels(upstream).set(pool_maxsize)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(upstream: str) -> requests.Session:
+    """Return the pooled session for an upstream, creating it on first use in this process"""
+    global _owner_pid
+
+    pid = os.getpid()
+    session = _sessions.get(upstream)
+    if session is not None and _owner_pid == pid:
+        return session
+
+    with _lock:
+        if _owner_pid != pid:
+            # Forked worker - never share sockets inherited from the parent
+            _sessions.clear()
+            _owner_pid = pid
+        session = _sessions.get(upstream)
+        if session is None:
+            session = _sessions[upstream] = _create_session(upstream)
+        return session
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Connection reuse statistics for every upstream session in this worker"""
+    stats = {}
+    for upstream, session in list(_sessions.items()):
+        hosts = {}
+        total_requests = 0
+        total_connections = 0
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                total_requests += pool.num_requests
+                total_connections += pool.num_connections
+                hosts[f'{pool.scheme}://{pool.host}:{pool.port}'] = {
+                    'requests': pool.num_requests,
+                    'connections_opened': pool.num_connections,
+                    # The pool queue is pre-filled with None placeholders for unopened slots
+                    'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+                    'maxsize': pool.pool.maxsize if pool.pool else 0
+                }
+
+        stats[upstream] = {
+            'requests': total_requests,
+            'connections_opened': total_connections,
+            'reuse_rate': round(1 - total_connections / total_requests, 4) if total_requests else None,
+            'hosts': hosts
+        }
+    return {'pid': os.getpid(), 'upstreams': stats}
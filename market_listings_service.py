@@ -1,27 +1,118 @@
 import requests
 from bs4 import BeautifulSoup
+import os
 import re
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Iterator, List, Dict, Optional, Tuple
 import logging
 
+from cache import create_cache
+from http_client import get_session
+from resilience import CircuitOpenError, call_upstream
+from singleflight import SingleFlight
+
+try:
+    import lxml.etree
+except ImportError:  # pragma: no cover - BeautifulSoup fallback
+    lxml = None
+
 logger = logging.getLogger(__name__)
 
+# Patterns for one pass over a listing's text nodes
+PRICE_PATTERN = re.compile(r'\$([\d,]+)')
+MILEAGE_PATTERN = re.compile(r'([\d,]+)\s*km', re.IGNORECASE)
+LOCATION_PATTERN = re.compile(r'\w+,\s*[A-Z]{2}')
+LISTING_LINK_PATTERN = re.compile(r'/a/')
+# Result containers: the classic result-item markup, else data-testid cards
+CONTAINER_CLASS_PATTERN = re.compile(r'result-item|listing-item')
+CONTAINER_TESTID_PATTERN = re.compile(r'listing|result')
+
+LXML_TEXT_XPATH = ".//text()[not(parent::script) and not(parent::style)]"
+
+# Result page sizes AutoTrader accepts for rcp
+PAGE_SIZES = (15, 25, 50, 100)
+STREAM_CHUNK_SIZE = 16384
+
 class MarketListingsService:
     """
     Service to fetch real market listings from AutoTrader Canada
     to compare against Blackbook valuations
     """
+
+    PROVINCE_CODES = {
+        'Alberta': 'AB', 'British Columbia': 'BC', 'Manitoba': 'MB',
+        'New Brunswick': 'NB', 'Newfoundland and Labrador': 'NL',
+        'Nova Scotia': 'NS', 'Ontario': 'ON', 'Prince Edward Island': 'PE',
+        'Quebec': 'QC', 'Saskatchewan': 'SK',
+        'Northwest Territories': 'NT', 'Nunavut': 'NU', 'Yukon': 'YT'
+    }
     
-    def __init__(self):
+    def __init__(self, parser: Optional[str] = None):
         self.base_url = "https://www.autotrader.ca"
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         }
-    
+        # 'lxml' (default when installed) or 'bs4' (BeautifulSoup with html.parser)
+        parser = parser or os.getenv('LISTINGS_PARSER', 'lxml')
+        self.parser = 'lxml' if parser == 'lxml' and lxml is not None else 'bs4'
+        # Provinces searched at once by search_listings_multi
+        self.max_concurrency = max(1, int(os.getenv('LISTINGS_MAX_CONCURRENCY', '13')))
+
+        # Parsed listings keyed by (year, make, model, province code), shared across workers
+        self.listings_cache = create_cache(
+            'listings',
+            max_entries=int(os.getenv('LISTINGS_CACHE_MAX_ENTRIES', '2000')),
+            ttl=float(os.getenv('LISTINGS_CACHE_TTL', '1800'))
+        )
+        self.listings_inflight = SingleFlight(store=getattr(self.listings_cache, 'shared', None))
+
+        # Result pages fetched per search before giving up on reaching max_results
+        self.max_pages = max(1, int(os.getenv('LISTINGS_MAX_PAGES', '3')))
+        self.pages_fetched = 0
+        self.bytes_read = 0
+        self.stopped_early = 0
+
+    def upstream_stats(self) -> Dict[str, Any]:
+        """Result pages fetched from AutoTrader, bytes read and pages cut off once enough listings were found"""
+        return {
+            'parser': self.parser,
+            'pages': self.pages_fetched,
+            'bytes': self.bytes_read,
+            'stopped_early': self.stopped_early
+        }
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            **self.listings_cache.stats(),
+            'inflight': self.listings_inflight.stats()
+        }
+
+    def _province_code(self, province: Optional[str]) -> str:
+        if not province:
+            return ''
+        return self.PROVINCE_CODES.get(province, province.upper())
+
+    def _cache_key(self, year: int, make: str, model: str, province: Optional[str]) -> Tuple:
+        return (year, make.strip().lower(), model.strip().lower(), self._province_code(province))
+
+    def _cached_listings(self, key: Tuple, max_results: int) -> Optional[List[Dict]]:
+        """Cached listings for a search, if the cached page holds enough results for max_results"""
+        entry = self.listings_cache.get(key)
+        if entry is None:
+            return None
+        listings = entry['listings']
+        # A page cut at fewer results can only answer a bigger request if it had no more
+        if entry['max_results'] < max_results and len(listings) >= entry['max_results']:
+            return None
+        return listings
+
     def search_listings(self, year: int, make: str, model: str, province: Optional[str] = None, max_results: int = 10) -> List[Dict]:
         """
         Search for vehicle listings on AutoTrader Canada
         
+        Results are cached per (year, make, model, province); concurrent
+        identical searches share one fetch.
+
         Args:
             year: Vehicle year
             make: Vehicle make
@@ -32,93 +123,243 @@ class MarketListingsService:
         Returns:
             List of listing dictionaries with price, mileage, location, etc.
         """
+        key = self._cache_key(year, make, model, province)
+        listings = self._cached_listings(key, max_results)
+        if listings is None:
+            listings = self.listings_inflight.do(
+                (*key, max_results),
+                lambda: self._fetch_listings(key, year, make, model, province, max_results),
+                lambda flight_key: self._cached_listings(key, max_results)
+            )
+
+        # Copies, so callers can annotate listings without touching the cache
+        return [dict(listing) for listing in listings[:max_results]]
+
+    def search_listings_multi(self, year: int, make: str, model: str, provinces: List[str],
+                              max_results: int = 10) -> List[Dict]:
+        """
+        Search several provinces concurrently and merge the results
+
+        Each listing is tagged with the province it was found in, and the
+        merged list is sorted by price. Sample listings from provinces
+        whose page could not be parsed are left out unless no province
+        returned real listings.
+        """
+        provinces = list(dict.fromkeys(provinces))
+        if not provinces:
+            return []
+
+        search = lambda province: self.search_listings(year, make, model, province, max_results)
+        workers = min(self.max_concurrency, len(provinces))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='listings-province') as executor:
+            results = list(executor.map(search, provinces))
+
+        merged = []
+        samples = []
+        for province, listings in zip(provinces, results):
+            for listing in listings:
+                listing['province'] = self._province_code(province)
+                (samples if listing.get('is_sample') else merged).append(listing)
+
+        merged = merged or samples[:max_results]
+        merged.sort(key=lambda listing: listing.get('price', 0))
+        return merged
+
+    def _fetch_listings(self, key: Tuple, year: int, make: str, model: str, province: Optional[str],
+                        max_results: int) -> List[Dict]:
+        """Collect up to max_results listings, caching a complete (non-sample) result"""
+        listings = []
         try:
-            search_url = self._build_search_url(year, make, model, province)
-            logger.info(f"Searching AutoTrader: {search_url}")
-            
-            response = requests.get(search_url, headers=self.headers, timeout=10)
-            response.raise_for_status()
-            
-            listings = self._parse_listings(response.text, max_results)
+            for listing in self.iter_listings(year, make, model, province, max_results):
+                listings.append(listing)
             logger.info(f"Found {len(listings)} listings")
             
-            return listings
+            if listings:
+                self.listings_cache.set(key, {'max_results': max_results, 'listings': listings})
+                return listings
             
+        except CircuitOpenError as e:
+            # AutoTrader is failing - don't hold the request for another timeout
+            logger.warning(f"Skipping listings search: {e}")
+            return listings
         except requests.RequestException as e:
             logger.error(f"Failed to fetch listings: {e}")
-            return []
+            return listings
         except Exception as e:
             logger.error(f"Error parsing listings: {e}")
-            return []
+            return listings
+
+        logger.warning("No listings found - AutoTrader HTML structure may have changed")
+        return self._create_sample_listings(max_results)
+
+    def iter_listings(self, year: int, make: str, model: str, province: Optional[str] = None,
+                      max_results: int = 10) -> Iterator[Dict]:
+        """
+        Yield listings from AutoTrader result pages as they are parsed
+
+        Pages are requested at the smallest size AutoTrader allows that
+        holds max_results, and each page is parsed while it downloads.
+        Fetching and parsing stop as soon as max_results listings have
+        been yielded; a further page (up to LISTINGS_MAX_PAGES) is only
+        requested when a full page held too few usable listings.
+        Upstream errors are raised to the caller after any listings
+        already yielded.
+        """
+        page_size = next((size for size in PAGE_SIZES if size >= max_results), PAGE_SIZES[-1])
+        found = 0
+        for page in range(self.max_pages):
+            search_url = self._build_search_url(year, make, model, province, page_size, page * page_size)
+            logger.info(f"Searching AutoTrader: {search_url}")
+
+            response = call_upstream(
+                'autotrader',
+                lambda: get_session('autotrader').get(search_url, headers=self.headers, timeout=10, stream=True)
+            )
+            self.pages_fetched += 1
+            containers = 0
+            try:
+                response.raise_for_status()
+                for listing in self._iter_response_listings(response):
+                    containers += 1
+                    if listing is None:
+                        continue
+                    yield listing
+                    found += 1
+                    if found >= max_results:
+                        self.stopped_early += 1
+                        return
+            finally:
+                # Closing mid-body drops the rest of the download
+                response.close()
+
+            if containers < page_size:
+                return  # Last page of results
+
+    def _iter_response_listings(self, response: requests.Response) -> Iterator[Optional[Dict]]:
+        """Listing (or None when unusable) for each result container, in page order"""
+        def chunks():
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                self.bytes_read += len(chunk)
+                yield chunk
+
+        if self.parser == 'lxml':
+            content_type = response.headers.get('Content-Type', '')
+            encoding = response.encoding if 'charset' in content_type.lower() else None
+            yield from self._iter_page_listings(chunks(), encoding)
+            return
+
+        html = b''.join(chunks()).decode(response.encoding or 'utf-8', errors='replace')
+        for texts, hrefs in self._bs4_containers(html, max(PAGE_SIZES)):
+            yield self._safe_extract(texts, hrefs)
+
+    def _iter_page_listings(self, chunks: Iterable[bytes], encoding: Optional[str] = None) -> Iterator[Optional[Dict]]:
+        """
+        Parse a result page incrementally with lxml, yielding each container as soon as it closes
+
+        Containers are matched as in _bs4_containers: the outermost div whose
+        class matches is one result, and data-testid divs only count on pages
+        without any. Those are the innermost matching divs (so a results
+        wrapper is not taken for a listing) and are yielded when the page
+        ends. Finished containers are cleared so memory stays flat however
+        long the page is.
+        """
+        try:
+            parser = lxml.etree.HTMLPullParser(events=('start', 'end'), encoding=encoding)
+        except LookupError:
+            # Charset lxml doesn't know - let it detect the encoding from the page
+            parser = lxml.etree.HTMLPullParser(events=('start', 'end'))
+        container = None
+        found = False
+        # Open data-testid divs as [element, has matching descendant], and the listings of innermost ones
+        testid_stack = []
+        testid_listings = []
+        for chunk in chunks:
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    if container is not None or element.tag != 'div':
+                        continue
+                    if CONTAINER_CLASS_PATTERN.search(element.get('class') or ''):
+                        container = element
+                    elif not found and CONTAINER_TESTID_PATTERN.search(element.get('data-testid') or ''):
+                        if testid_stack:
+                            testid_stack[-1][1] = True
+                        testid_stack.append([element, False])
+                elif element is container:
+                    found = True
+                    testid_listings = []
+                    yield self._safe_extract(element.xpath(LXML_TEXT_XPATH), element.xpath('.//a/@href'))
+                    container = None
+                    element.clear(keep_tail=True)
+                elif testid_stack and element is testid_stack[-1][0]:
+                    _, nested = testid_stack.pop()
+                    if not found and not nested:
+                        testid_listings.append(
+                            self._safe_extract(element.xpath(LXML_TEXT_XPATH), element.xpath('.//a/@href'))
+                        )
+                        element.clear(keep_tail=True)
+
+        if not found:
+            yield from testid_listings
+
+    def _safe_extract(self, texts: Iterable[str], hrefs: Iterable[str]) -> Optional[Dict]:
+        try:
+            return self._extract_listing_data(texts, hrefs)
+        except Exception as e:
+            logger.debug(f"Failed to parse listing: {e}")
+            return None
     
-    def _build_search_url(self, year: int, make: str, model: str, province: Optional[str] = None) -> str:
-        """Build AutoTrader search URL"""
+    def _build_search_url(self, year: int, make: str, model: str, province: Optional[str] = None,
+                          page_size: int = 100, offset: int = 0) -> str:
+        """Build AutoTrader search URL for one page of results"""
         make_slug = make.lower().replace(' ', '-')
         model_slug = model.lower().replace(' ', '-')
         
-        url = f"{self.base_url}/cars/{make_slug}/{model_slug}/?rcp=100&rcs=0&srt=35&yRng={year}%2C{year}&prx=-1&hprc=True&wcp=True&sts=New-Used&inMarket=advancedSearch"
+        url = f"{self.base_url}/cars/{make_slug}/{model_slug}/?rcp={page_size}&rcs={offset}&srt=35&yRng={year}%2C{year}&prx=-1&hprc=True&wcp=True&sts=New-Used&inMarket=advancedSearch"
         
         if province:
-            province_map = {
-                'Alberta': 'AB', 'British Columbia': 'BC', 'Manitoba': 'MB',
-                'New Brunswick': 'NB', 'Newfoundland and Labrador': 'NL',
-                'Nova Scotia': 'NS', 'Ontario': 'ON', 'Prince Edward Island': 'PE',
-                'Quebec': 'QC', 'Saskatchewan': 'SK',
-                'Northwest Territories': 'NT', 'Nunavut': 'NU', 'Yukon': 'YT'
-            }
-            prov_code = province_map.get(province, province)
+            prov_code = self.PROVINCE_CODES.get(province, province)
             url += f"&loc={prov_code}"
         
         return url
     
-    def _parse_listings(self, html: str, max_results: int) -> List[Dict]:
-        """Parse listings from AutoTrader HTML"""
+    def _bs4_containers(self, html: str, max_results: int) -> List[tuple]:
+        """(text nodes, link hrefs) for each result container, parsed with BeautifulSoup"""
         soup = BeautifulSoup(html, 'html.parser')
-        listings = []
-        
-        listing_containers = soup.find_all('div', class_=re.compile(r'result-item|listing-item'), limit=max_results)
-        
-        if not listing_containers:
-            listing_containers = soup.find_all('div', {'data-testid': re.compile(r'listing|result')}, limit=max_results)
-        
-        for container in listing_containers[:max_results]:
-            try:
-                listing = self._extract_listing_data(container)
-                if listing and listing.get('price'):
-                    listings.append(listing)
-            except Exception as e:
-                logger.debug(f"Failed to parse listing: {e}")
-                continue
-        
-        if not listings:
-            logger.warning("No listings found - AutoTrader HTML structure may have changed")
-            return self._create_sample_listings(max_results)
-        
-        return listings
+        containers = soup.find_all('div', class_=CONTAINER_CLASS_PATTERN, limit=max_results)
+        if not containers:
+            containers = soup.find_all('div', {'data-testid': CONTAINER_TESTID_PATTERN}, limit=max_results)
+        return [
+            (list(container.strings), [link.get('href') for link in container.find_all('a', href=True)])
+            for container in containers
+        ]
     
-    def _extract_listing_data(self, container) -> Optional[Dict]:
-        """Extract data from a single listing container"""
+    def _extract_listing_data(self, texts: Iterable[str], hrefs: Iterable[str]) -> Optional[Dict]:
+        """
+        Extract data from a single listing container in one pass over its text
+
+        Each field is taken from the first text node that matches its
+        pattern, in document order.
+        """
         listing = {}
         
-        price_elem = container.find(text=re.compile(r'\$[\d,]+'))
-        if price_elem:
-            price_text = re.search(r'\$([\d,]+)', price_elem.string or str(price_elem))
-            if price_text:
-                listing['price'] = int(price_text.group(1).replace(',', ''))
-        
-        mileage_elem = container.find(text=re.compile(r'[\d,]+\s*km', re.IGNORECASE))
-        if mileage_elem:
-            mileage_text = re.search(r'([\d,]+)\s*km', mileage_elem.string or str(mileage_elem), re.IGNORECASE)
-            if mileage_text:
-                listing['mileage_km'] = int(mileage_text.group(1).replace(',', ''))
-        
-        link_elem = container.find('a', href=re.compile(r'/a/'))
-        if link_elem and link_elem.get('href'):
-            listing['url'] = self.base_url + link_elem['href']
+        for text in texts:
+            if 'price' not in listing:
+                match = PRICE_PATTERN.search(text)
+                if match:
+                    listing['price'] = int(match.group(1).replace(',', ''))
+            if 'mileage_km' not in listing:
+                match = MILEAGE_PATTERN.search(text)
+                if match:
+                    listing['mileage_km'] = int(match.group(1).replace(',', ''))
+            if 'location' not in listing and LOCATION_PATTERN.search(text):
+                listing['location'] = text.strip()
+            if len(listing) == 3:
+                break
         
-        location_elem = container.find(text=re.compile(r'\w+,\s*[A-Z]{2}'))
-        if location_elem:
-            listing['location'] = location_elem.string.strip()
+        href = next((href for href in hrefs if href and LISTING_LINK_PATTERN.search(href)), None)
+        if href:
+            listing['url'] = self.base_url + href
         
         return listing if listing.get('price') else None
     
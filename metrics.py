@@ -0,0 +1,111 @@
+"""
+Prometheus metrics for requests, upstream calls and caches
+
+Exposed at /metrics. Under gunicorn every worker writes its samples to
+PROMETHEUS_MULTIPROC_DIR (set up by gunicorn.conf.py) and a scrape of any
+worker aggregates all of them; without it, the process's own samples are
+served. The metrics:
+
+    http_requests_total{endpoint, method, status}
+    http_request_duration_seconds{endpoint}
+    http_requests_in_progress{endpoint}
+    upstream_request_duration_seconds{upstream, outcome}   one sample per attempt;
+                                                           outcome ok/error/timeout/rate_limited/cancelled
+    upstream_rejected_total{upstream, reason}              calls failed fast by an open breaker
+    upstream_in_flight{upstream}
+    upstream_pool_maxsize{upstream}                        keep-alive connections per host; with
+                                                           upstream_in_flight gives pool saturation
+    blackbook_province_duration_seconds{province, status}  pricing fetched from Blackbook, per province
+    cache_lookups_total{cache, result}                     result memory_hit/shared_hit/hit/miss
+
+prometheus_client is optional; without it every metric is a no-op and
+/metrics answers 503.
+"""
+
+import os
+import time
+from typing import Tuple
+
+try:
+    from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                                   generate_latest, multiprocess)
+    PROMETHEUS_AVAILABLE = True
+except ImportError:  # pragma: no cover - optional dependency
+    PROMETHEUS_AVAILABLE = False
+
+
+class _NoopMetric:
+    """Stands in for a metric (and its labelled children) when prometheus_client is missing"""
+
+    def labels(self, *args, **kwargs) -> '_NoopMetric':
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+
+# Upstream calls run from a few milliseconds (cache-warm NHTSA) to the 15s call timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2.5, 5, 7.5, 10, 15, 30)
+
+if PROMETHEUS_AVAILABLE:
+    HTTP_REQUESTS = Counter(
+        'http_requests_total', 'HTTP requests handled', ['endpoint', 'method', 'status']
+    )
+    HTTP_LATENCY = Histogram(
+        'http_request_duration_seconds', 'Time to build each HTTP response', ['endpoint'],
+        buckets=LATENCY_BUCKETS
+    )
+    HTTP_IN_PROGRESS = Gauge(
+        'http_requests_in_progress', 'HTTP requests being handled', ['endpoint'],
+        multiprocess_mode='livesum'
+    )
+    UPSTREAM_LATENCY = Histogram(
+        'upstream_request_duration_seconds', 'Duration of each upstream call attempt', ['upstream', 'outcome'],
+        buckets=LATENCY_BUCKETS
+    )
+    UPSTREAM_REJECTED = Counter(
+        'upstream_rejected_total', 'Upstream calls failed fast without being made', ['upstream', 'reason']
+    )
+    UPSTREAM_IN_FLIGHT = Gauge(
+        'upstream_in_flight', 'Upstream call attempts in progress', ['upstream'],
+        multiprocess_mode='livesum'
+    )
+    UPSTREAM_POOL_MAXSIZE = Gauge(
+        'upstream_pool_maxsize', 'Keep-alive connections allowed per upstream host', ['upstream'],
+        multiprocess_mode='livesum'
+    )
+    PROVINCE_LATENCY = Histogram(
+        'blackbook_province_duration_seconds', 'Time to fetch one province pricing from Blackbook',
+        ['province', 'status'], buckets=LATENCY_BUCKETS
+    )
+    CACHE_LOOKUPS = Counter(
+        'cache_lookups_total', 'Cache lookups by outcome', ['cache', 'result']
+    )
+else:
+    HTTP_REQUESTS = HTTP_LATENCY = HTTP_IN_PROGRESS = _NoopMetric()
+    UPSTREAM_LATENCY = UPSTREAM_REJECTED = UPSTREAM_IN_FLIGHT = UPSTREAM_POOL_MAXSIZE = _NoopMetric()
+    PROVINCE_LATENCY = CACHE_LOOKUPS = _NoopMetric()
+
+
+def observe_upstream(upstream: str, outcome: str, started: float) -> None:
+    """Record an upstream call attempt that began at time.perf_counter() value `started`"""
+    UPSTREAM_LATENCY.labels(upstream, outcome).observe(time.perf_counter() - started)
+
+
+def render() -> Tuple[bytes, str]:
+    """The exposition body and content type for a /metrics scrape"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
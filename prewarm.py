@@ -0,0 +1,365 @@
+"""
+Cache prewarm job
+=================
+
+Fills the pricing and NHTSA caches for a known run list (e.g. the morning's
+auction lots) so the first lookups of the day are served from cache.
+
+The run list is either a CSV with vin and mileage columns (a header row is
+optional; without one the first two columns are used) or a JSON-lines
+request log where each line holds a {"vin": ..., "mileage": ...} object,
+directly or under "body"/"json"/"request"/"data".
+
+Run from the command line:
+    python prewarm.py runlist.csv --rate 2 --workers 4
+or start it from the admin page (POST /api/admin/prewarm).
+"""
+
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from ratelimit import BATCH, priority_lane
+
+MILEAGE_COLUMNS = ('mileage', 'odometer', 'odometer_km', 'km')
+NESTED_FIELDS = ('body', 'json', 'request', 'data', 'params')
+
+
+def _find_vehicle(record: Any) -> Optional[Dict[str, Any]]:
+    """Locate the object carrying vin/mileage in a request log line"""
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError:
+            return None
+    if not isinstance(record, dict):
+        return None
+    if 'vin' in record:
+        return record
+    for field in NESTED_FIELDS:
+        found = _find_vehicle(record.get(field))
+        if found is not None:
+            return found
+    return None
+
+
+def _vehicle(vin: Any, mileage: Any) -> Optional[Tuple[str, int]]:
+    vin = str(vin or '').strip().upper()
+    try:
+        value = float(str(mileage).replace(',', '').strip())
+        # inf, -inf and nan ("inf", "1e400", "nan") are not mileages
+        if not math.isfinite(value):
+            return None
+        mileage = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if len(vin) != 17 or mileage < 0:
+        return None
+    return vin, mileage
+
+
+def parse_run_list(text: str, fmt: Optional[str] = None) -> Tuple[List[Tuple[str, int]], int]:
+    """
+    Parse a CSV or JSON-lines run list
+
+    Returns (vehicles, skipped): unique (VIN, mileage) pairs in file order
+    and the number of lines without a usable VIN and mileage.
+    """
+    if fmt is None:
+        fmt = 'jsonl' if text.lstrip().startswith(('{', '[')) else 'csv'
+
+    rows = []
+    if fmt == 'jsonl':
+        stripped = text.strip()
+        if stripped.startswith('['):
+            records = json.loads(stripped)
+        else:
+            records = [line for line in stripped.splitlines() if line.strip()]
+        for record in records:
+            found = _find_vehicle(record)
+            if found is None:
+                rows.append(None)
+                continue
+            mileage = next((found.get(column) for column in MILEAGE_COLUMNS if found.get(column) is not None), None)
+            rows.append(_vehicle(found.get('vin'), mileage))
+    else:
+        lines = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+        header = [cell.strip().lower() for cell in lines[0]] if lines else []
+        if 'vin' in header:
+            vin_index = header.index('vin')
+            mileage_index = next((header.index(column) for column in MILEAGE_COLUMNS if column in header), None)
+            lines = lines[1:]
+        else:
+            vin_index, mileage_index = 0, 1
+        for row in lines:
+            vin = row[vin_index] if vin_index < len(row) else None
+            mileage = row[mileage_index] if mileage_index is not None and mileage_index < len(row) else None
+            rows.append(_vehicle(vin, mileage))
+
+    vehicles = list(dict.fromkeys(row for row in rows if row is not None))
+    return vehicles, sum(1 for row in rows if row is None)
+
+
+class RateLimiter:
+    """Spread calls evenly: at most `rate` acquisitions per second across all threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class PrewarmJob:
+    """
+    Warm the caches for a list of (VIN, mileage) pairs on a rate-limited pool
+
+    Pricing goes through BlackbookService.fetch_pricing_cards, so cards are
+    cached exactly as an interactive lookup would cache them, but in the
+    batch lane of the Blackbook rate limiter; `decode_vin` (when given)
+    fills the NHTSA cache the same way.
+    """
+
+    def __init__(self, blackbook_service, vehicles: List[Tuple[str, int]],
+                 decode_vin: Optional[Callable[[str], Dict[str, Any]]] = None,
+                 rate: float = 2, workers: int = 4, skipped: int = 0):
+        self.blackbook_service = blackbook_service
+        self.vehicles = vehicles
+        self.decode_vin = decode_vin
+        self.rate = rate
+        self.workers = max(1, workers)
+        self.skipped = skipped
+        self._lock = threading.Lock()
+        self._limiter = RateLimiter(rate)
+        self.started_at = None
+        self.finished_at = None
+        self.done = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.nhtsa_failed = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    @property
+    def running(self) -> bool:
+        return self.started_at is not None and self.finished_at is None
+
+    def _warm(self, vin: str, mileage: int) -> Dict[str, Any]:
+        self._limiter.acquire()
+        started = time.monotonic()
+        line = {'vin': vin, 'mileage': mileage}
+
+        try:
+            with priority_lane(BATCH):
+                pricing = self.blackbook_service.fetch_pricing_cards(vin, mileage)
+        except Exception as e:
+            pricing = {'success': False, 'error': f'Unexpected error: {str(e)}'}
+        line['success'] = bool(pricing.get('success'))
+        if not line['success']:
+            line['error'] = pricing.get('error')
+
+        if self.decode_vin is not None:
+            try:
+                decoded = self.decode_vin(vin)
+            except Exception as e:
+                decoded = {'success': False, 'error': f'NHTSA error: {str(e)}'}
+            line['nhtsa'] = bool(decoded.get('success'))
+
+        line['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        return line
+
+    def run(self, progress: Optional[Callable[[Dict[str, Any], Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Warm every vehicle; progress(line, status) is called as each one finishes"""
+        self.started_at = time.time()
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prewarm')
+        try:
+            futures = [executor.submit(self._warm, vin, mileage) for vin, mileage in self.vehicles]
+            for future in as_completed(futures):
+                line = future.result()
+                with self._lock:
+                    self.done += 1
+                    if line['success']:
+                        self.succeeded += 1
+                    else:
+                        self.failed += 1
+                        self.errors = (self.errors + [line])[-50:]
+                    if line.get('nhtsa') is False:
+                        self.nhtsa_failed += 1
+                if progress is not None:
+                    progress(line, self.status())
+        finally:
+            executor.shutdown(wait=True)
+            self.finished_at = time.time()
+        return self.status()
+
+    def start(self) -> threading.Thread:
+        """Run the job on a background thread"""
+        self.started_at = time.time()
+        thread = threading.Thread(target=self.run, name='prewarm-job', daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            started = self.started_at
+            elapsed = ((self.finished_at or time.time()) - started) if started else 0
+            remaining = len(self.vehicles) - self.done
+            per_vehicle = elapsed / self.done if self.done else None
+            return {
+                'running': self.running,
+                'total': len(self.vehicles),
+                'done': self.done,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'nhtsa_failed': self.nhtsa_failed,
+                'skipped': self.skipped,
+                'rate_per_second': self.rate,
+                'workers': self.workers,
+                'elapsed_seconds': round(elapsed, 3),
+                'eta_seconds': round(per_vehicle * remaining, 1) if per_vehicle and self.running else None,
+                'recent_errors': list(self.errors[-10:])
+            }
+
+
+class PrewarmState:
+    """
+    The node's prewarm job, as seen by every worker
+
+    The job's status is written to `store` (the shared cache.SQLiteCache,
+    or a TTLCache when the cache is per-process) every `interval` seconds
+    while it runs, so any worker can report its progress and refuse a
+    second job. A job whose status stops being refreshed for `stale_after`
+    seconds (its worker exited) no longer counts as running.
+    """
+
+    KEY = 'job'
+    LOCK_TTL = 5  # seconds the start lock is held at most
+
+    def __init__(self, store, interval: float = 1, stale_after: float = 30, keep: float = 86400):
+        self.store = store
+        self.interval = interval
+        self.stale_after = stale_after
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def status(self) -> Optional[Dict[str, Any]]:
+        """Status of the last job started on this node, or None"""
+        entry = self.store.get(self.KEY)
+        if entry is None:
+            return None
+        status = dict(entry['status'])
+        if status['running'] and time.time() - entry['updated_at'] > self.stale_after:
+            status['running'] = False
+            status['eta_seconds'] = None
+            status['error'] = 'Job stopped reporting progress (its worker exited)'
+        return status
+
+    def _publish(self, job: PrewarmJob) -> None:
+        self.store.set(self.KEY, {'status': job.status(), 'updated_at': time.time()}, ttl=self.keep)
+
+    def _track(self, job: PrewarmJob, thread: threading.Thread) -> None:
+        while thread.is_alive():
+            self._publish(job)
+            thread.join(self.interval)
+        self._publish(job)
+
+    def start(self, job: PrewarmJob) -> Optional[Dict[str, Any]]:
+        """
+        Start `job` unless one is already running on the node
+
+        Returns None once the job is started, or the running job's status.
+        """
+        owner = f'{os.getpid()}:{uuid.uuid4().hex}'
+        with self._lock:
+            locked = self._acquire(owner)
+            try:
+                running = self.status()
+                if not locked:
+                    return running or {'running': True}
+                if running is not None and running['running']:
+                    return running
+                thread = job.start()
+                self._publish(job)
+            finally:
+                if locked and hasattr(self.store, 'release_lock'):
+                    self.store.release_lock(self.KEY, owner)
+
+        threading.Thread(target=self._track, args=(job, thread), name='prewarm-status', daemon=True).start()
+        return None
+
+    def _acquire(self, owner: str) -> bool:
+        """Take the node-wide start lock; in-process stores only need self._lock"""
+        if not hasattr(self.store, 'acquire_lock'):
+            return True
+        deadline = time.monotonic() + self.LOCK_TTL
+        while not self.store.acquire_lock(self.KEY, owner, self.LOCK_TTL):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Prewarm the pricing and NHTSA caches from a run list')
+    parser.add_argument('path', help='CSV (vin,mileage) or JSON-lines request log; - for stdin')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help='input format (default: detect)')
+    parser.add_argument('--rate', type=float, default=2, help='vehicles started per second (0 = unlimited)')
+    parser.add_argument('--workers', type=int, default=4, help='vehicles priced at once')
+    parser.add_argument('--no-nhtsa', action='store_true', help='skip the NHTSA decode cache')
+    args = parser.parse_args(argv)
+
+    if args.path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(args.path, encoding='utf-8') as f:
+            text = f.read()
+
+    vehicles, skipped = parse_run_list(text, args.format)
+    if not vehicles:
+        print(f'No vehicles to prewarm ({skipped} unusable lines)', file=sys.stderr)
+        return 1
+
+    # Imported here so the caches are the ones the app itself uses
+    from app import blackbook_service, vin_decoder_service
+
+    job = PrewarmJob(
+        blackbook_service,
+        vehicles,
+        decode_vin=None if args.no_nhtsa else vin_decoder_service.decode,
+        rate=args.rate,
+        workers=args.workers,
+        skipped=skipped
+    )
+    print(f'Prewarming {len(vehicles)} vehicles ({skipped} lines skipped) '
+          f'at {args.rate or "unlimited"}/s with {job.workers} workers')
+
+    def report(line, status):
+        outcome = 'ok' if line['success'] else f"failed: {line.get('error')}"
+        print(f"[{status['done']}/{status['total']}] {line['vin']} {line['mileage']} km "
+              f"{outcome} ({line['elapsed_seconds']}s)", flush=True)
+
+    status = job.run(progress=report)
+    print(f"Done in {status['elapsed_seconds']}s: {status['succeeded']} succeeded, "
+          f"{status['failed']} failed, {status['nhtsa_failed']} NHTSA decode failures")
+    return 0 if not status['failed'] else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
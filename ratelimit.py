@@ -0,0 +1,307 @@
+"""
+Outbound rate limiting with priority lanes
+
+Calls to Blackbook draw tokens from one bucket shared by every worker on
+the node (a row in the shared cache SQLite file), so the node as a whole
+stays within the upstream quota however many workers are running.
+
+Each call runs in a lane. Interactive requests (the default) may take any
+token. Batch traffic (batch appraisals, prewarm jobs, background cache
+refreshes) may not take the last `batch_reserve` share of the bucket, and
+stands back entirely while an interactive caller is waiting for a token.
+Run code in the batch lane with:
+
+    with priority_lane(BATCH):
+        blackbook_service.fetch_pricing_cards(vin, mileage)
+
+The lane is held in a contextvar, so it follows asyncio tasks; work handed
+to a thread pool must be submitted with contextvars.copy_context().run.
+"""
+
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import requests
+
+from cache import shared_cache_path
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+LANES = (INTERACTIVE, BATCH)
+
+_lane: contextvars.ContextVar = contextvars.ContextVar('upstream_lane', default=INTERACTIVE)
+
+
+def current_lane() -> str:
+    return _lane.get()
+
+
+@contextmanager
+def priority_lane(lane: str) -> Iterator[None]:
+    """Run the enclosed calls in `lane` (INTERACTIVE or BATCH)"""
+    if lane not in LANES:
+        raise ValueError(f'Unknown lane: {lane}')
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class RateLimitedError(requests.exceptions.Timeout):
+    """No token could be had within the call's timeout; callers treat it as a timeout"""
+
+    def __init__(self, name: str, lane: str, retry_in: float):
+        super().__init__(f'{name} rate limit: no {lane} token available for {retry_in:.2f}s')
+        self.name = name
+        self.lane = lane
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    """
+    Token bucket for one upstream in this process, with priority lanes
+
+    Refills at `rate` tokens per second up to `burst`. A rate of 0 turns
+    limiting off. Subclasses keep the bucket state elsewhere by overriding
+    _take.
+    """
+
+    MAX_SLEEP = 0.25  # re-check at least this often while waiting
+    BLOCKING_TAKE = False  # whether _take does I/O and must stay off the event loop
+
+    def __init__(self, name: str, rate: float, burst: float, batch_reserve: float = 0.3):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        # Tokens batch traffic must leave in the bucket for interactive callers
+        self.reserve = min(self.burst - 1, max(0.0, batch_reserve) * self.burst)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated_at = time.time()
+        self._interactive_until = 0.0
+        self._stats = {lane: {'granted': 0, 'waited': 0, 'wait_seconds': 0.0, 'rejected': 0} for lane in LANES}
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _decide(self, lane: str, now: float, tokens: float, updated_at: float,
+                interactive_until: float) -> Tuple[float, float, float]:
+        """
+        Refill and try to take a token in `lane`
+
+        Returns (wait, tokens, interactive_until): wait is 0 when the token
+        was taken, else roughly how long until one could be. An interactive
+        caller that has to wait marks the bucket so batch callers stand back
+        until it has been served.
+        """
+        tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+        if lane == INTERACTIVE:
+            if tokens >= 1:
+                return 0.0, tokens - 1, interactive_until
+            wait = (1 - tokens) / self.rate
+            return wait, tokens, max(interactive_until, now + wait + 1 / self.rate)
+
+        floor = 1 + self.reserve
+        if tokens >= floor and now >= interactive_until:
+            return 0.0, tokens - 1, interactive_until
+        return max((floor - tokens) / self.rate, interactive_until - now), tokens, interactive_until
+
+    def _take(self, lane: str) -> float:
+        with self._lock:
+            now = time.time()
+            wait, self._tokens, self._interactive_until = self._decide(
+                lane, now, self._tokens, self._updated_at, self._interactive_until
+            )
+            self._updated_at = now
+            return wait
+
+    def _note(self, lane: str, waited: Optional[float]) -> None:
+        with self._lock:
+            stats = self._stats[lane]
+            if waited is None:
+                stats['rejected'] += 1
+                return
+            stats['granted'] += 1
+            if waited > 0:
+                stats['waited'] += 1
+                stats['wait_seconds'] += waited
+
+    def acquire(self, lane: Optional[str] = None, timeout: Optional[float] = None) -> float:
+        """
+        Wait for a token in `lane` (default: the current lane)
+
+        Returns the seconds spent waiting. Raises RateLimitedError as soon
+        as a token clearly cannot be had within `timeout` seconds.
+        """
+        if not self.enabled:
+            return 0.0
+        lane = lane or current_lane()
+        started = None
+        while True:
+            wait = self._take(lane)
+            waited = time.monotonic() - started if started is not None else 0.0
+            if wait <= 0:
+                self._note(lane, waited)
+                return waited
+            if timeout is not None and waited + wait > timeout:
+                self._note(lane, None)
+                raise RateLimitedError(self.name, lane, wait)
+            if started is None:
+                started = time.monotonic()
+            time.sleep(min(wait, self.MAX_SLEEP))
+
+    async def acquire_async(self, lane: Optional[str] = None, timeout: Optional[float] = None) -> float:
+        """asyncio counterpart of acquire"""
+        if not self.enabled:
+            return 0.0
+        lane = lane or current_lane()
+        started = None
+        while True:
+            wait = await asyncio.to_thread(self._take, lane) if self.BLOCKING_TAKE else self._take(lane)
+            waited = time.monotonic() - started if started is not None else 0.0
+            if wait <= 0:
+                self._note(lane, waited)
+                return waited
+            if timeout is not None and waited + wait > timeout:
+                self._note(lane, None)
+                raise RateLimitedError(self.name, lane, wait)
+            if started is None:
+                started = time.monotonic()
+            await asyncio.sleep(min(wait, self.MAX_SLEEP))
+
+    def _state(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'tokens': self._tokens, 'updated_at': self._updated_at}
+
+    def stats(self) -> Dict[str, Any]:
+        state = self._state()
+        tokens = min(self.burst, state['tokens'] + max(0.0, time.time() - state['updated_at']) * self.rate)
+        with self._lock:
+            lanes = {lane: {**stats, 'wait_seconds': round(stats['wait_seconds'], 3)}
+                     for lane, stats in self._stats.items()}
+        return {
+            'enabled': self.enabled,
+            'shared': False,
+            'rate': self.rate,
+            'burst': self.burst,
+            'batch_reserve': round(self.reserve, 2),
+            'tokens': round(tokens, 2),
+            'lanes': lanes
+        }
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """
+    TokenBucket whose state lives in the shared cache SQLite file
+
+    Every worker on the node takes tokens from the same row inside an
+    immediate transaction. If the database cannot be used, the worker
+    falls back to its in-process bucket rather than failing calls.
+    """
+
+    BLOCKING_TAKE = True
+
+    def __init__(self, path: str, name: str, rate: float, burst: float, batch_reserve: float = 0.3):
+        super().__init__(name, rate, burst, batch_reserve)
+        self.path = path
+        self._local = threading.local()
+        self.errors = 0
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    interactive_until REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening a new one after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _take(self, lane: str) -> float:
+        try:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = conn.execute(
+                    "SELECT tokens, updated_at, interactive_until FROM rate_limits WHERE name = ?",
+                    (self.name,)
+                ).fetchone()
+                tokens, updated_at, interactive_until = row if row else (self.burst, now, 0.0)
+                wait, tokens, interactive_until = self._decide(lane, now, tokens, updated_at, interactive_until)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at, interactive_until) VALUES (?, ?, ?, ?)",
+                    (self.name, tokens, now, interactive_until)
+                )
+                conn.execute('COMMIT')
+                return wait
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            self.errors += 1
+            return super()._take(lane)
+
+    def _state(self) -> Dict[str, Any]:
+        try:
+            row = self._connect().execute(
+                "SELECT tokens, updated_at FROM rate_limits WHERE name = ?",
+                (self.name,)
+            ).fetchone()
+        except sqlite3.Error:
+            self.errors += 1
+            row = None
+        if row is None:
+            return super()._state()
+        return {'tokens': row[0], 'updated_at': row[1]}
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), 'shared': True, 'errors': self.errors}
+
+
+def create_rate_limiter(upstream: str) -> TokenBucket:
+    """
+    Build the outbound rate limiter for an upstream from the environment
+
+    <UPSTREAM>_RATE_LIMIT is calls per second for the whole node (0 turns
+    limiting off), <UPSTREAM>_RATE_BURST the bucket size (default twice the
+    rate) and <UPSTREAM>_RATE_BATCH_RESERVE the share of the bucket batch
+    traffic must leave for interactive callers (default 0.3). The bucket is
+    shared through the cache SQLite file unless SHARED_CACHE_PATH is empty.
+    """
+    prefix = upstream.upper()
+    rate = float(os.getenv(f'{prefix}_RATE_LIMIT', '25'))
+    burst = float(os.getenv(f'{prefix}_RATE_BURST', str(rate * 2)))
+    batch_reserve = float(os.getenv(f'{prefix}_RATE_BATCH_RESERVE', '0.3'))
+
+    path = shared_cache_path()
+    if path and rate > 0:
+        try:
+            return SQLiteTokenBucket(path, upstream, rate, burst, batch_reserve)
+        except (sqlite3.Error, OSError):
+            pass
+    return TokenBucket(upstream, rate, burst, batch_reserve)
@@ -0,0 +1,83 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class BackgroundRefresher:
+    """
+    Run cache refreshes on a small background thread pool
+
+    Each key is refreshed by at most one task at a time in this process:
+    keys already queued or running are skipped when submitted again. When
+    more than `max_pending` keys are waiting, new submissions are dropped
+    and the stale entries are simply served until their hard TTL.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 1000):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = None
+        self._owner_pid = None
+        self.submitted = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_workers > 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Threads don't survive a fork - start a fresh pool in each worker
+        pid = os.getpid()
+        if self._executor is None or self._owner_pid != pid:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='cache-refresh')
+            self._owner_pid = pid
+            self._pending = set()
+        return self._executor
+
+    def submit(self, keys: List[Hashable], refresh: Callable[[List[Hashable]], Any]) -> int:
+        """Queue refresh(keys) for the keys not already being refreshed; returns how many were queued"""
+        if not self.enabled:
+            return 0
+
+        with self._lock:
+            executor = self._get_executor()
+            new = [key for key in keys if key not in self._pending]
+            self.skipped += len(keys) - len(new)
+            if not new:
+                return 0
+            if len(self._pending) + len(new) > self.max_pending:
+                self.dropped += len(new)
+                return 0
+            self._pending.update(new)
+            self.submitted += len(new)
+
+        executor.submit(self._run, new, refresh)
+        return len(new)
+
+    def _run(self, keys: List[Hashable], refresh: Callable[[List[Hashable]], Any]) -> None:
+        try:
+            refresh(keys)
+            self.completed += len(keys)
+        except Exception:
+            self.failed += len(keys)
+        finally:
+            with self._lock:
+                self._pending.difference_update(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'pending': len(self._pending),
+                'submitted': self.submitted,
+                'skipped': self.skipped,
+                'dropped': self.dropped,
+                'completed': self.completed,
+                'failed': self.failed
+            }
@@ -0,0 +1,397 @@
+"""
+Latency tracking, hedging/retry budgets and circuit breakers for upstream APIs
+
+Every outbound call to Blackbook, NHTSA and AutoTrader goes through
+call_upstream (or call_upstream_async), which applies the upstream's
+circuit breaker and retries connection errors and 5xx responses with
+jittered backoff while the shared retry budget allows it.
+
+Breaker settings are read per upstream, e.g. for NHTSA:
+    NHTSA_BREAKER_FAILURES  consecutive failures that open the breaker (default 5)
+    NHTSA_BREAKER_RESET     seconds to stay open before a trial call (default 30)
+    NHTSA_RETRIES           budgeted retries per call (default 1)
+UPSTREAM_RETRY_BUDGET is the fraction of calls that may be retried (default 0.1).
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import requests
+
+from http_client import upstream_setting
+from metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_REJECTED, observe_upstream
+from ratelimit import RateLimitedError
+
+
+class LatencyTracker:
+    """
+    Rolling latency distribution per upstream operation
+
+    Keeps the last `window` call durations for each operation (e.g.
+    'pricing', 'vehicle') in this process. Percentiles are only reported
+    once `min_samples` calls have been seen, so a cold worker falls back
+    to the fixed timeouts.
+    """
+
+    def __init__(self, window: int = 500, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+
+    def record(self, operation: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(operation)
+            if samples is None:
+                samples = self._samples[operation] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._counts[operation] = self._counts.get(operation, 0) + 1
+
+    def percentile(self, operation: str, percent: float) -> Optional[float]:
+        """Latency in seconds below which `percent`% of recent calls finished, or None"""
+        with self._lock:
+            samples = self._samples.get(operation)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self) -> Dict[str, Any]:
+        operations = {}
+        for operation in list(self._samples):
+            p50, p95, p99 = (self.percentile(operation, percent) for percent in (50, 95, 99))
+            operations[operation] = {
+                'calls': self._counts.get(operation, 0),
+                'samples': len(self._samples[operation]),
+                'p50': round(p50, 4) if p50 is not None else None,
+                'p95': round(p95, 4) if p95 is not None else None,
+                'p99': round(p99, 4) if p99 is not None else None
+            }
+        return operations
+
+
+class RetryBudget:
+    """
+    Token budget that caps extra requests at a fraction of primary calls
+
+    Every primary call earns `ratio` tokens (up to `max_tokens`) and every
+    extra request spends one, so over time at most `ratio` extra load is
+    sent upstream, with a small burst allowance. A degraded upstream
+    therefore sees a bounded number of retries instead of a retry storm.
+    """
+
+    def __init__(self, ratio: float = 0.1, max_tokens: float = 10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.spent = 0
+        self.denied = 0
+
+    def note_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def spend(self) -> bool:
+        """Take a token for one extra request; False when the budget is exhausted"""
+        with self._lock:
+            if self._tokens < 1:
+                self.denied += 1
+                return False
+            self._tokens -= 1
+            self.spent += 1
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'ratio': self.ratio,
+                'tokens': round(self._tokens, 2),
+                'calls': self.calls,
+                'spent': self.spent,
+                'denied': self.denied
+            }
+
+
+class HedgeBudget(RetryBudget):
+    """RetryBudget for hedged duplicates of slow calls"""
+
+    def __init__(self, ratio: float = 0.05, max_tokens: float = 10):
+        super().__init__(ratio, max_tokens)
+        self.hedges_won = 0
+
+    def note_win(self) -> None:
+        with self._lock:
+            self.hedges_won += 1
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        return {
+            'ratio': stats['ratio'],
+            'tokens': stats['tokens'],
+            'calls': stats['calls'],
+            'hedges': stats['spent'],
+            'hedges_won': self.hedges_won,
+            'denied': stats['denied']
+        }
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open"""
+
+    def __init__(self, upstream: str, retry_in: float):
+        super().__init__(f'{upstream} circuit open, retrying in {retry_in:.0f}s')
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker for one upstream
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    calls fail fast for `reset_timeout` seconds. It then goes half-open and
+    lets `half_open_max` trial calls through: a success closes it again, a
+    failure reopens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30, half_open_max: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.opened = 0
+        self.rejected = 0
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def retry_in(self) -> float:
+        with self._lock:
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; half-open admits a limited number of trial calls"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._probes < self.half_open_max:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.successes += 1
+            self._failures = 0
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._probes = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.opened += 1
+
+    def release(self) -> None:
+        """Give back a half-open trial slot for a call that was abandoned without an outcome"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            state = self._current_state()
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'retry_in': round(max(0.0, self._opened_at + self.reset_timeout - time.monotonic()), 1) if state == self.OPEN else None,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'successes': self.successes,
+                'failures': self.failures
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+# One budget for retries to every upstream
+retry_budget = RetryBudget(ratio=float(os.getenv('UPSTREAM_RETRY_BUDGET', '0.1')))
+
+
+def get_breaker(upstream: str) -> CircuitBreaker:
+    """Return this worker's circuit breaker for an upstream"""
+    breaker = _breakers.get(upstream)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(upstream)
+            if breaker is None:
+                breaker = _breakers[upstream] = CircuitBreaker(
+                    upstream,
+                    failure_threshold=int(upstream_setting(upstream, 'BREAKER_FAILURES', '5')),
+                    reset_timeout=float(upstream_setting(upstream, 'BREAKER_RESET', '30'))
+                )
+    return breaker
+
+
+def breaker_stats() -> Dict[str, Any]:
+    return {upstream: breaker.stats() for upstream, breaker in list(_breakers.items())}
+
+
+def backoff_delay(attempt: int, base: float = 0.1, cap: float = 2.0) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def _failed_status(status: Optional[int]) -> bool:
+    return status is not None and (status >= 500 or status == 429)
+
+
+def call_upstream(upstream: str, call: Callable[[], requests.Response], retries: Optional[int] = None) -> requests.Response:
+    """
+    Make one logical call to an upstream through its circuit breaker
+
+    Raises CircuitOpenError without calling when the breaker is open.
+    Exceptions and 5xx/429 responses count as failures; connection errors
+    and 5xx/429 are retried up to `retries` times (default *_RETRIES)
+    with jittered backoff while the shared retry budget allows. Timeouts
+    are not retried: a slow upstream only gets slower with more load.
+    """
+    breaker = get_breaker(upstream)
+    if retries is None:
+        retries = int(upstream_setting(upstream, 'RETRIES', '1'))
+    retry_budget.note_call()
+
+    in_flight = UPSTREAM_IN_FLIGHT.labels(upstream)
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            UPSTREAM_REJECTED.labels(upstream, 'circuit_open').inc()
+            raise CircuitOpenError(upstream, breaker.retry_in())
+
+        started = time.perf_counter()
+        try:
+            in_flight.inc()
+            try:
+                response = call()
+            finally:
+                in_flight.dec()
+        except RateLimitedError:
+            # Throttled locally before reaching the upstream - not a failure
+            observe_upstream(upstream, 'rate_limited', started)
+            breaker.release()
+            raise
+        except Exception as e:
+            observe_upstream(upstream, 'timeout' if isinstance(e, requests.Timeout) else 'error', started)
+            breaker.record_failure()
+            retryable = isinstance(e, requests.ConnectionError) and not isinstance(e, requests.Timeout)
+            if retryable and attempt < retries and retry_budget.spend():
+                attempt += 1
+                time.sleep(backoff_delay(attempt))
+                continue
+            raise
+
+        failed = _failed_status(getattr(response, 'status_code', None))
+        observe_upstream(upstream, 'error' if failed else 'ok', started)
+        if failed:
+            breaker.record_failure()
+            if attempt < retries and retry_budget.spend():
+                attempt += 1
+                time.sleep(backoff_delay(attempt))
+                continue
+        else:
+            breaker.record_success()
+        return response
+
+
+async def call_upstream_async(upstream: str, call: Callable[[], Awaitable[Any]], retries: Optional[int] = None) -> Any:
+    """
+    asyncio counterpart of call_upstream for calls returning (status, body)
+
+    Any exception counts as a failure; cancelled calls release their
+    half-open trial slot without an outcome.
+    """
+    breaker = get_breaker(upstream)
+    if retries is None:
+        retries = int(upstream_setting(upstream, 'RETRIES', '1'))
+    retry_budget.note_call()
+
+    in_flight = UPSTREAM_IN_FLIGHT.labels(upstream)
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            UPSTREAM_REJECTED.labels(upstream, 'circuit_open').inc()
+            raise CircuitOpenError(upstream, breaker.retry_in())
+
+        started = time.perf_counter()
+        try:
+            in_flight.inc()
+            try:
+                result = await call()
+            finally:
+                in_flight.dec()
+        except (asyncio.CancelledError, RateLimitedError) as e:
+            observe_upstream(upstream, 'rate_limited' if isinstance(e, RateLimitedError) else 'cancelled', started)
+            breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            observe_upstream(upstream, 'timeout', started)
+            breaker.record_failure()
+            raise
+        except Exception:
+            observe_upstream(upstream, 'error', started)
+            breaker.record_failure()
+            if attempt < retries and retry_budget.spend():
+                attempt += 1
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            raise
+
+        failed = _failed_status(result[0])
+        observe_upstream(upstream, 'error' if failed else 'ok', started)
+        if failed:
+            breaker.record_failure()
+            if attempt < retries and retry_budget.spend():
+                attempt += 1
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+        else:
+            breaker.record_success()
+        return result
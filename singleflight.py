@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+class _Flight:
+    """One in-progress upstream call that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent lookups of the same key into a single upstream call
+
+    Within a process, callers asking for a key that is already being fetched
+    wait for that fetch and share its result. When a shared store is given
+    (a cache.SQLiteCache), the leader also takes a lock row in it; a worker
+    that finds the lock held by another process polls `lookup` until the
+    other worker has filled the cache, and only fetches itself if the lock
+    expires or is released without a cached value.
+    """
+
+    def __init__(self, store=None, lock_ttl: float = 30, poll_interval: float = 0.05):
+        self.store = store
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.remote_waits = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], lookup: Optional[Callable[[Hashable], Any]] = None) -> Any:
+        """Run fn() once for all concurrent callers of key and return its result"""
+        return self.do_many([key], lambda keys: {key: fn()}, lookup)[key]
+
+    def do_many(self, keys: List[Hashable], fetch: Callable[[List[Hashable]], Dict[Hashable, Any]],
+                lookup: Optional[Callable[[Hashable], Any]] = None) -> Dict[Hashable, Any]:
+        """
+        Resolve several keys at once
+
+        `fetch` receives the keys this caller leads and must return a result
+        for each of them; keys already in flight elsewhere are waited on.
+        """
+        leading = {}
+        following = {}
+        with self._lock:
+            for key in keys:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                    leading[key] = flight
+                else:
+                    following[key] = flight
+            self.leaders += len(leading)
+            self.coalesced += len(following)
+
+        results = {}
+        owner = f'{os.getpid()}:{uuid.uuid4().hex}'
+        locked = []
+        try:
+            pending = list(leading)
+            if self.store is not None and pending:
+                locked = [key for key in pending if self.store.acquire_lock(key, owner, self.lock_ttl)]
+                foreign = [key for key in pending if key not in locked]
+                if foreign and lookup is not None:
+                    results.update(self._wait_for_other_workers(foreign, lookup))
+                pending = [key for key in pending if key not in results]
+
+            if pending:
+                results.update(fetch(pending))
+
+            for key, flight in leading.items():
+                flight.result = results.get(key)
+        except BaseException as e:
+            for flight in leading.values():
+                flight.error = e
+            raise
+        finally:
+            for key in locked:
+                self.store.release_lock(key, owner)
+            with self._lock:
+                for key, flight in leading.items():
+                    self._flights.pop(key, None)
+                    flight.done.set()
+
+        for key, flight in following.items():
+            results[key] = flight.wait()
+        return results
+
+    def _wait_for_other_workers(self, keys: List[Hashable], lookup: Callable[[Hashable], Any]) -> Dict[Hashable, Any]:
+        """Poll the shared cache while another worker holds the lock for these keys"""
+        self.remote_waits += len(keys)
+        found = {}
+        waiting = list(keys)
+        deadline = time.monotonic() + self.lock_ttl
+        while waiting and time.monotonic() < deadline:
+            for key in list(waiting):
+                value = lookup(key)
+                if value is not None:
+                    found[key] = value
+                    waiting.remove(key)
+                elif not self.store.is_locked(key):
+                    # Released without a cached result (e.g. upstream error)
+                    waiting.remove(key)
+            if waiting:
+                time.sleep(self.poll_interval)
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'remote_waits': self.remote_waits
+            }
@@ -31,6 +31,84 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    const prewarmBtn = document.getElementById('prewarmBtn');
+    const prewarmRunList = document.getElementById('prewarmRunList');
+    const prewarmRate = document.getElementById('prewarmRate');
+    const prewarmErrorMessage = document.getElementById('prewarmErrorMessage');
+    const prewarmStatus = document.getElementById('prewarmStatus');
+    let prewarmTimer = null;
+
+    prewarmBtn.addEventListener('click', async function() {
+        prewarmErrorMessage.style.display = 'none';
+        prewarmBtn.disabled = true;
+
+        try {
+            const response = await fetch('/api/admin/prewarm', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    run_list: prewarmRunList.value,
+                    rate: parseFloat(prewarmRate.value) || 0
+                })
+            });
+
+            const data = await response.json();
+
+            if (data.status) {
+                showPrewarmStatus(data.status);
+            }
+            if (!data.success) {
+                prewarmErrorMessage.textContent = data.error || 'Failed to start prewarm';
+                prewarmErrorMessage.style.display = 'block';
+            }
+            if (data.status && data.status.running) {
+                pollPrewarm();
+            } else {
+                prewarmBtn.disabled = false;
+            }
+        } catch (error) {
+            prewarmBtn.disabled = false;
+            prewarmErrorMessage.textContent = 'Network error: Unable to connect to the server';
+            prewarmErrorMessage.style.display = 'block';
+        }
+    });
+
+    function pollPrewarm() {
+        clearTimeout(prewarmTimer);
+        prewarmTimer = setTimeout(async function() {
+            try {
+                const response = await fetch('/api/admin/prewarm');
+                const data = await response.json();
+                if (data.status) {
+                    showPrewarmStatus(data.status);
+                }
+                if (data.status && data.status.running) {
+                    pollPrewarm();
+                    return;
+                }
+            } catch (error) {
+                // Keep the last status on screen
+            }
+            prewarmBtn.disabled = false;
+        }, 1000);
+    }
+
+    function showPrewarmStatus(status) {
+        let text = `${status.done}/${status.total} vehicles warmed in ${status.elapsed_seconds}s ` +
+            `(${status.succeeded} succeeded, ${status.failed} failed`;
+        if (status.skipped) {
+            text += `, ${status.skipped} lines skipped`;
+        }
+        text += ')';
+        if (status.running && status.eta_seconds !== null) {
+            text += ` - about ${Math.ceil(status.eta_seconds)}s remaining`;
+        }
+        prewarmStatus.textContent = text;
+        prewarmStatus.style.display = 'block';
+    }
+
     function showLoading(show) {
         testLoadingIndicator.style.display = show ? 'block' : 'none';
         testBtn.disabled = show;
@@ -72,32 +72,56 @@ document.addEventListener('DOMContentLoaded', function() {
 
         console.log("Sending to /api/pricing-cards:", body);
 
-        try {
-            const response = await fetch('/api/pricing-cards', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(body)
-            });
+        // The market listings search starts as soon as the VIN decode or the
+        // card stream has identified the vehicle, alongside the pricing
+        let resolveVehicle;
+        const vehicle = new Promise(resolve => { resolveVehicle = resolve; });
+        const identifyVehicle = function(info) {
+            if (info && info.year && info.make && info.model) {
+                resolveVehicle(info);
+            }
+        };
+        const decoded = fetchVinDecode(vin).then(info => {
+            identifyVehicle(info);
+            return info;
+        });
+        const market = vehicle.then(fetchMarketListings);
 
-            const data = await response.json();
+        try {
+            // Stream cards as provinces complete; fall back to a single POST
+            const data = window.EventSource
+                ? await streamPricingCards(body, identifyVehicle)
+                : await fetchPricingCards(body);
 
-            console.log("Status:", response.status);
+            console.log("Status:", data.status);
             console.log("Response:", data);
 
             showLoading(false);
 
-            if (data.cards && data.cards.length > 0) {
-                await displayVinDecode(vinInput.value);
-                displayAuctionRecommendation(data.cards);
-                displayMarketTrends(data.cards);
+            // Provinces that failed or timed out come back as cards without pricing
+            const pricedCards = (data.cards || []).filter(isPriced);
+
+            if (pricedCards.length > 0) {
+                identifyVehicle(pricedCards[0]);
+                displayAuctionRecommendation(pricedCards);
+                displayMarketTrends(pricedCards);
                 displayPricingCards(data.cards);
-                await displayMarketListings(data.cards);
-                showSuccess('Pricing data retrieved from Blackbook successfully!');
+                decoded.then(displayVinDecode);
+
+                // Listings are compared with the average Blackbook retail value
+                const retail = pricedCards.map(card => card.adjusted_retail).filter(value => value);
+                const blackbookRetail = retail.length > 0
+                    ? Math.round(retail.reduce((sum, value) => sum + value, 0) / retail.length)
+                    : 0;
+                market.then(listings => displayMarketListings({ ...listings, blackbook_retail: blackbookRetail }));
+
+                const missing = data.cards.filter(card => !isPriced(card)).map(card => card.province);
+                showSuccess(missing.length > 0
+                    ? `Pricing data retrieved from Blackbook (unavailable for ${missing.join(', ')})`
+                    : 'Pricing data retrieved from Blackbook successfully!');
             } else {
                 const errorMsg = data.error || 'Failed to fetch pricing data';
-                showError(`Error ${response.status}: ${errorMsg}`);
+                showError(`Error ${data.status}: ${errorMsg}`);
                 console.error("API Error:", errorMsg);
             }
         } catch (error) {
@@ -107,7 +131,65 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
-    async function displayVinDecode(vin) {
+    function isPriced(card) {
+        return !card.status || card.status === 'ok';
+    }
+
+    async function fetchPricingCards(body) {
+        const response = await fetch('/api/pricing-cards', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(body)
+        });
+
+        const data = await response.json();
+        return { ...data, status: response.status };
+    }
+
+    function streamPricingCards(body, onVehicle) {
+        // Render each province card as soon as the server sends it
+        return new Promise((resolve, reject) => {
+            const params = new URLSearchParams({ vin: body.vin, mileage: body.mileage });
+            const source = new EventSource(`/api/pricing-cards/stream?${params}`);
+            const cards = [];
+
+            source.addEventListener('vehicle', function(e) {
+                showLoading(false);
+                pricingCardsGrid.innerHTML = '';
+                onVehicle(JSON.parse(e.data));
+            });
+
+            source.addEventListener('card', function(e) {
+                cards.push(JSON.parse(e.data));
+                displayPricingCards([...cards]);
+            });
+
+            // A province that failed or missed the deadline still gets a (greyed out) card
+            source.addEventListener('province_error', function(e) {
+                cards.push(JSON.parse(e.data));
+                displayPricingCards([...cards]);
+            });
+
+            source.addEventListener('done', function() {
+                source.close();
+                resolve({ status: 200, cards: cards });
+            });
+
+            // Fired both for server "error" events (with data) and for connection failures
+            source.addEventListener('error', function(e) {
+                source.close();
+                if (e.data) {
+                    resolve({ status: 400, ...JSON.parse(e.data) });
+                } else {
+                    reject(new Error('Pricing stream connection failed'));
+                }
+            });
+        });
+    }
+
+    async function fetchVinDecode(vin) {
         try {
             const response = await fetch('/api/decode-vin', {
                 method: 'POST',
@@ -118,9 +200,37 @@ document.addEventListener('DOMContentLoaded', function() {
             });
 
             const data = await response.json();
+            return data.success ? data.vehicle_info : null;
+        } catch (error) {
+            console.log('VIN decode failed:', error);
+            return null;
+        }
+    }
+
+    async function fetchMarketListings(vehicle) {
+        try {
+            const response = await fetch('/api/market-listings', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    year: vehicle.year,
+                    make: vehicle.make,
+                    model: vehicle.model
+                })
+            });
+
+            return await response.json();
+        } catch (error) {
+            console.log('Market listings fetch failed:', error);
+            return null;
+        }
+    }
 
-            if (data.success && data.vehicle_info) {
-                const info = data.vehicle_info;
+    function displayVinDecode(info) {
+        try {
+            if (info) {
                 
                 let engineInfo = '';
                 if (info.engine || info.displacement) {
@@ -485,10 +595,11 @@ document.addEventListener('DOMContentLoaded', function() {
         // Clear existing cards
         pricingCardsGrid.innerHTML = '';
 
-        // Sort cards by retail price (highest to lowest)
-        const sortedCards = cards.sort((a, b) => {
+        // Sort cards by retail price (highest to lowest); provinces without pricing go last
+        const sortedCards = cards.filter(isPriced).sort((a, b) => {
             return (b.adjusted_retail || 0) - (a.adjusted_retail || 0);
         });
+        const unavailableCards = cards.filter(card => !isPriced(card));
 
         // Calculate national averages for comparison
         const avgWholesale = sortedCards.reduce((sum, c) => sum + (c.adjusted_wholesale || 0), 0) / sortedCards.length;
@@ -505,6 +616,13 @@ document.addEventListener('DOMContentLoaded', function() {
             pricingCardsGrid.appendChild(cardElement);
         });
 
+        unavailableCards.forEach(card => {
+            const cardElement = document.createElement('div');
+            cardElement.className = 'pricing-card unavailable';
+            cardElement.innerHTML = createUnavailableCardHTML(card);
+            pricingCardsGrid.appendChild(cardElement);
+        });
+
         pricingCardsContainer.style.display = 'block';
     }
 
@@ -604,6 +722,19 @@ document.addEventListener('DOMContentLoaded', function() {
         `;
     }
 
+    function createUnavailableCardHTML(card) {
+        return `
+            <div class="province-header">
+                <h3>📍 ${card.province}</h3>
+                <div class="opportunity-badge neutral">${card.status === 'timeout' ? '⏱️ TIMED OUT' : '⚠️ UNAVAILABLE'}</div>
+            </div>
+            <div class="pricing-item">
+                <div class="pricing-label">Pricing</div>
+                <div class="pricing-value" style="font-size: 0.95rem;">${card.error || 'No pricing returned for this province'}</div>
+            </div>
+        `;
+    }
+
     function showLoading(show) {
         loadingIndicator.style.display = show ? 'block' : 'none';
         form.querySelector('button[type="submit"]').disabled = show;
@@ -623,29 +754,9 @@ document.addEventListener('DOMContentLoaded', function() {
         successMessage.style.display = 'block';
     }
 
-    async function displayMarketListings(cards) {
-        if (!cards || cards.length === 0) return;
-
-        const firstCard = cards[0];
-        const avgRetail = cards.reduce((sum, c) => sum + (c.adjusted_retail_rough || 0), 0) / cards.length;
-
+    function displayMarketListings(data) {
         try {
-            const response = await fetch('/api/market-listings', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    year: firstCard.year,
-                    make: firstCard.make,
-                    model: firstCard.model,
-                    blackbook_retail: Math.round(avgRetail)
-                })
-            });
-
-            const data = await response.json();
-
-            if (data.success && data.listings && data.listings.length > 0) {
+            if (data && data.success && data.listings && data.listings.length > 0) {
                 // Calculate market statistics
                 const prices = data.listings.map(l => l.price).filter(p => p && !isNaN(p));
                 const sortedPrices = [...prices].sort((a, b) => a - b);
@@ -654,7 +765,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 const medianPrice = sortedPrices[Math.floor(sortedPrices.length / 2)];
                 const minPrice = Math.min(...prices);
                 const maxPrice = Math.max(...prices);
-                const blackbookRetail = Math.round(avgRetail);
+                // Average Blackbook retail across priced provinces, as compared server-side
+                const blackbookRetail = data.blackbook_retail || 0;
                 const avgVsBlackbook = avgPrice - blackbookRetail;
                 const avgVsBlackbookPct = blackbookRetail > 0 ? ((avgVsBlackbook / blackbookRetail) * 100).toFixed(1) : 0;
                 
@@ -703,7 +815,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 marketListingsContainer.style.display = 'block';
             }
         } catch (error) {
-            console.log('Market listings fetch failed:', error);
+            console.log('Market listings display failed:', error);
         }
     }
 
@@ -0,0 +1,236 @@
+import logging
+import os
+import sqlite3
+from typing import Any, Dict, List, Optional
+
+from cache import create_cache
+from http_client import get_session
+from resilience import CircuitOpenError, call_upstream
+from singleflight import SingleFlight
+from vin_validation import validate_vin, vin_squish
+from vpic_snapshot import VpicSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class VinDecoderService:
+    """
+    Decode VINs with NHTSA's vPIC API
+
+    Decoded vehicle info is cached by VIN and by VIN squish, so NHTSA is
+    called once per vehicle pattern; concurrent decodes of the same pattern
+    share one call. With a local vPIC snapshot (VPIC_SNAPSHOT_PATH), VINs it
+    can resolve are decoded in-process and never reach the remote API.
+    Malformed VINs and VINs NHTSA recently could not decode are rejected
+    without a call.
+    """
+
+    DECODE_URL = 'https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVin/{vin}?format=json'
+
+    def __init__(self):
+        cache_entries = int(os.getenv('NHTSA_CACHE_MAX_ENTRIES', '5000'))
+        cache_ttl = float(os.getenv('NHTSA_CACHE_TTL', '2592000'))
+        # Decoded vehicle info keyed by VIN, and by squish without the VIN itself
+        self.cache = create_cache('nhtsa', max_entries=cache_entries, ttl=cache_ttl)
+        self.squish_cache = create_cache('nhtsa_squish', max_entries=cache_entries, ttl=cache_ttl)
+        # VINs NHTSA could not decode -> its error text
+        self.unknown_vins = create_cache(
+            'nhtsa_unknown',
+            max_entries=cache_entries,
+            ttl=float(os.getenv('UNKNOWN_VIN_CACHE_TTL', '86400'))
+        )
+        self.use_squish = os.getenv('NHTSA_SQUISH_CACHE', 'true').lower() in ('1', 'true', 'yes')
+        self.timeout = float(os.getenv('NHTSA_TIMEOUT', '10'))
+        self.inflight = SingleFlight(store=getattr(self.cache, 'shared', None))
+
+        self.snapshot = None
+        snapshot_path = os.getenv('VPIC_SNAPSHOT_PATH')
+        if snapshot_path:
+            try:
+                self.snapshot = VpicSnapshot(snapshot_path)
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"vPIC snapshot unavailable, decoding remotely: {e}")
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            **self.cache.stats(),
+            'squish': self.squish_cache.stats(),
+            'unknown_vins': self.unknown_vins.stats(),
+            'inflight': self.inflight.stats(),
+            'snapshot': self.snapshot.stats() if self.snapshot is not None else None
+        }
+
+    def _cached(self, vin: str, squish: Optional[str]) -> Optional[Dict[str, Any]]:
+        vehicle_info = self.cache.get(vin)
+        if vehicle_info is None and squish is not None:
+            pattern = self.squish_cache.get(squish)
+            if pattern is not None:
+                vehicle_info = {'vin': vin, **pattern}
+                self.cache.set(vin, vehicle_info)
+        return vehicle_info
+
+    def decode(self, vin: str) -> Dict[str, Any]:
+        """
+        Decode a 17-character VIN, using the NHTSA caches
+
+        Returns {'success': True, 'vehicle_info': {...}} or {'success': False, 'error': ...}
+        ('invalid': True for a malformed VIN, 'not_found': True when NHTSA
+        cannot decode it, 'unavailable': True while the NHTSA circuit breaker
+        is open); requests exceptions (e.g. Timeout) propagate to the caller.
+        """
+        vin_error = validate_vin(vin)
+        if vin_error:
+            return {
+                'success': False,
+                'invalid': True,
+                'error': vin_error
+            }
+
+        vin = vin.upper()
+        squish = vin_squish(vin) if self.use_squish else None
+        vehicle_info = self._cached(vin, squish)
+        if vehicle_info is not None:
+            return {
+                'success': True,
+                'vehicle_info': vehicle_info
+            }
+
+        error = self.unknown_vins.get(vin)
+        if error is not None:
+            return {
+                'success': False,
+                'not_found': True,
+                'error': error
+            }
+
+        if self.snapshot is not None:
+            results = self.snapshot.decode(vin)
+            if results is not None:
+                return {
+                    'success': True,
+                    'vehicle_info': self._parse_results(vin, results)
+                }
+
+        # VINs of one pattern share a single NHTSA call
+        result = self.inflight.do(
+            squish or vin,
+            lambda: self._fetch(vin, squish),
+            lambda key: self._hit(vin, squish)
+        )
+        if result.get('success') and result['vehicle_info'].get('vin') != vin:
+            result = {'success': True, 'vehicle_info': {**result['vehicle_info'], 'vin': vin}}
+        return result
+
+    def _hit(self, vin: str, squish: Optional[str]) -> Optional[Dict[str, Any]]:
+        vehicle_info = self._cached(vin, squish)
+        return None if vehicle_info is None else {'success': True, 'vehicle_info': vehicle_info}
+
+    def _fetch(self, vin: str, squish: Optional[str]) -> Dict[str, Any]:
+        try:
+            response = call_upstream(
+                'nhtsa',
+                lambda: get_session('nhtsa').get(self.DECODE_URL.format(vin=vin), timeout=self.timeout)
+            )
+        except CircuitOpenError:
+            return {
+                'success': False,
+                'unavailable': True,
+                'error': 'NHTSA API temporarily unavailable - please try again shortly'
+            }
+
+        if response.status_code != 200:
+            return {
+                'success': False,
+                'error': f'NHTSA API error: {response.status_code}'
+            }
+
+        nhtsa_data = response.json()
+
+        if 'Results' not in nhtsa_data:
+            return {
+                'success': False,
+                'error': 'Invalid response from NHTSA'
+            }
+
+        vehicle_info = self._parse_results(vin, nhtsa_data['Results'])
+        if not vehicle_info.get('make'):
+            # Nothing decoded - e.g. an unregistered manufacturer code
+            error = self._index_results(nhtsa_data['Results']).get('Error Text') or 'No vehicle data found for this VIN'
+            self.unknown_vins.set(vin, error)
+            return {
+                'success': False,
+                'not_found': True,
+                'error': error
+            }
+
+        self.cache.set(vin, vehicle_info)
+        if squish is not None:
+            self.squish_cache.set(squish, {k: v for k, v in vehicle_info.items() if k != 'vin'})
+
+        return {
+            'success': True,
+            'vehicle_info': vehicle_info
+        }
+
+    @staticmethod
+    def _index_results(results: List[Dict[str, Any]]) -> Dict[str, str]:
+        """Variable -> value for a DecodeVin Results list (first non-empty value per variable)"""
+        values = {}
+        for item in results:
+            variable = item.get('Variable')
+            value = item.get('Value')
+            if variable and value and variable not in values:
+                values[variable] = str(value).strip()
+        return values
+
+    def _parse_results(self, vin: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Turn a DecodeVin Results list into the vehicle info returned to clients"""
+        values = self._index_results(results)
+        get_value = lambda variable_name: values.get(variable_name) or None
+
+        # Get trim information - combine multiple fields for complete picture
+        trim = get_value('Trim')
+        trim2 = get_value('Trim2')
+        series = get_value('Series')
+        series2 = get_value('Series2')
+
+        # Build comprehensive trim description
+        trim_parts = []
+        if series:
+            trim_parts.append(series)
+        if series2 and series2 != series:
+            trim_parts.append(series2)
+        if trim:
+            trim_parts.append(trim)
+        if trim2 and trim2 != trim:
+            trim_parts.append(trim2)
+
+        full_trim = ' '.join(trim_parts) if trim_parts else None
+
+        vehicle_info = {
+            'vin': vin,
+            'make': get_value('Make'),
+            'model': get_value('Model'),
+            'year': get_value('Model Year'),
+            'trim': full_trim or trim or series,  # Comprehensive trim info
+            'trim_level': trim,  # Basic trim level
+            'series': series,  # Series/grade
+            'body_class': get_value('Body Class'),
+            'engine': get_value('Engine Model') or get_value('Displacement (L)'),
+            'engine_config': get_value('Engine Configuration'),
+            'cylinders': get_value('Engine Number of Cylinders'),
+            'displacement': get_value('Displacement (L)'),
+            'transmission': get_value('Transmission Style'),
+            'transmission_speeds': get_value('Transmission Speeds'),
+            'drive_type': get_value('Drive Type'),
+            'fuel_type': get_value('Fuel Type - Primary'),
+            'manufacturer': get_value('Manufacturer Name'),
+            'plant': get_value('Plant City') or get_value('Plant Country'),
+            'vehicle_type': get_value('Vehicle Type'),
+            'doors': get_value('Doors'),
+            'windows': get_value('Windows'),
+            'seat_rows': get_value('Seat Rows')
+        }
+
+        # Remove None values
+        return {k: v for k, v in vehicle_info.items() if v}
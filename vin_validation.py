@@ -0,0 +1,84 @@
+"""
+Local VIN validation, run before any upstream call
+
+A VIN is 17 characters from A-Z and 0-9 without I, O and Q. Position 9 is a
+check digit (ISO 3779 / 49 CFR 565) computed from the other 16 characters.
+North American VINs (a WMI starting 1-5) must carry a valid check digit;
+elsewhere it is optional, so by default other VINs only get the
+character-set check. VIN_CHECK_DIGIT chooses which VINs are checked:
+
+    north_america   VINs made for North America (default)
+    all             every VIN
+    off             none
+
+vin_squish gives the vehicle-pattern part of a VIN, the key used to share
+cached lookups between VINs of the same pattern.
+"""
+
+import os
+import re
+from typing import Optional
+
+VIN_PATTERN = re.compile(r'^[A-HJ-NPR-Z0-9]{17}$')
+
+CHECK_DIGIT_MODES = ('north_america', 'all', 'off')
+
+# Letter values per ISO 3779; digits stand for themselves
+TRANSLITERATION = {
+    **{str(digit): digit for digit in range(10)},
+    'A': 1, 'B': 2, 'C': 3, 'D': 4, 'E': 5, 'F': 6, 'G': 7, 'H': 8,
+    'J': 1, 'K': 2, 'L': 3, 'M': 4, 'N': 5, 'P': 7, 'R': 9,
+    'S': 2, 'T': 3, 'U': 4, 'V': 5, 'W': 6, 'X': 7, 'Y': 8, 'Z': 9
+}
+WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+
+# First WMI character of vehicles made for the United States, Canada and Mexico
+NORTH_AMERICA = '12345'
+
+
+def check_digit(vin: str) -> str:
+    """Expected position-9 character of a 17-character VIN ('0'-'9' or 'X')"""
+    remainder = sum(TRANSLITERATION[char] * weight for char, weight in zip(vin.upper(), WEIGHTS)) % 11
+    return 'X' if remainder == 10 else str(remainder)
+
+
+def is_north_american(vin: str) -> bool:
+    return vin[:1] in NORTH_AMERICA
+
+
+def check_digit_mode() -> str:
+    mode = os.getenv('VIN_CHECK_DIGIT', 'north_america').lower()
+    return mode if mode in CHECK_DIGIT_MODES else 'north_america'
+
+
+def validate_vin(vin: str, mode: Optional[str] = None) -> Optional[str]:
+    """
+    Return why a VIN is invalid, or None when it is well-formed
+
+    `mode` overrides VIN_CHECK_DIGIT for this call.
+    """
+    vin = (vin or '').upper()
+    if not VIN_PATTERN.match(vin):
+        return 'VIN must be exactly 17 alphanumeric characters (excluding I, O, Q)'
+
+    mode = mode or check_digit_mode()
+    if mode == 'off' or (mode == 'north_america' and not is_north_american(vin)):
+        return None
+
+    expected = check_digit(vin)
+    if vin[8] != expected:
+        return f'VIN check digit does not match (position 9 is {vin[8]}, expected {expected}) - please check the VIN for typos'
+    return None
+
+
+def vin_squish(vin: str) -> Optional[str]:
+    """
+    VIN positions 1-8 and 10-11: the vehicle pattern without check digit and serial
+
+    None for low-volume manufacturers (a '9' in position 3), whose
+    manufacturer code continues into positions 12-14.
+    """
+    vin = vin.upper()
+    if len(vin) != 17 or vin[2] == '9':
+        return None
+    return vin[:8] + vin[9:11]
@@ -0,0 +1,368 @@
+"""
+Offline VIN decoding from a local vPIC snapshot
+===============================================
+
+NHTSA publishes the vPIC database that backs its DecodeVin API. This module
+imports the parts of it needed to decode the fields we show (make, model,
+year, trim, body, engine, drivetrain, ...) into a compact SQLite file, and
+decodes VINs against it in-process. VinDecoderService uses the snapshot
+when VPIC_SNAPSHOT_PATH points at one, and only calls the remote API for
+VINs the snapshot cannot resolve.
+
+Build a snapshot from CSV exports of the vPIC standalone database tables
+(one <Table>.csv per table, with the column names used by vPIC):
+
+    python vpic_snapshot.py import /path/to/vpic-csv blackbook_vpic.sqlite3
+
+Tables read: Wmi, Wmi_Make, Make, Manufacturer, VehicleType,
+Wmi_VinSchema, Pattern, Element, and the lookup table named by each
+imported element's LookupTable column (Model, BodyStyle, DriveType, ...).
+
+Decode a VIN against a snapshot:
+
+    python vpic_snapshot.py decode blackbook_vpic.sqlite3 1HGCV1F38LA000401
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# vPIC element names (the DecodeVin "Variable") the snapshot keeps
+ELEMENTS = (
+    'Make', 'Model', 'Trim', 'Trim2', 'Series', 'Series2', 'Body Class',
+    'Engine Model', 'Engine Configuration', 'Engine Number of Cylinders',
+    'Displacement (L)', 'Transmission Style', 'Transmission Speeds',
+    'Drive Type', 'Fuel Type - Primary', 'Plant City', 'Plant Country',
+    'Doors', 'Windows', 'Seat Rows'
+)
+
+# A decode is only trusted when it resolves all of these
+REQUIRED = ('Make', 'Model', 'Model Year')
+
+# Position 10 model year codes; the cycle repeats every 30 years
+YEAR_CODES = 'ABCDEFGHJKLMNPRSTVWXY123456789'
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS wmi (
+        wmi TEXT PRIMARY KEY,
+        make TEXT,
+        manufacturer TEXT,
+        vehicle_type TEXT
+    );
+    CREATE TABLE IF NOT EXISTS schemas (
+        wmi TEXT NOT NULL,
+        schema_id INTEGER NOT NULL,
+        year_from INTEGER,
+        year_to INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS schemas_wmi ON schemas (wmi);
+    CREATE TABLE IF NOT EXISTS patterns (
+        id INTEGER NOT NULL,
+        schema_id INTEGER NOT NULL,
+        keys TEXT NOT NULL,
+        element TEXT NOT NULL,
+        value TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS patterns_schema ON patterns (schema_id);
+"""
+
+
+def model_year(vin: str) -> Optional[int]:
+    """
+    Model year from VIN position 10
+
+    Codes repeat every 30 years. For the letter codes (1980-2000 and
+    2010-2030) the tie is broken as NHTSA does for light vehicles: a letter
+    in position 7 means the later cycle. The digit codes only stand for
+    2001-2009 so far. A year past next year's models is not a real one, so
+    None is returned and the caller falls back to the remote API.
+    """
+    code = vin[9].upper() if len(vin) == 17 else ''
+    index = YEAR_CODES.find(code) if code else -1
+    if index < 0:
+        return None
+    year = 1980 + index
+    if code.isalpha() and vin[6].isalpha():
+        year += 30
+    if year > time.localtime().tm_year + 1:
+        return None
+    return year
+
+
+def wmi_of(vin: str) -> str:
+    """World manufacturer identifier; 6 characters for low-volume makers ('9' in position 3)"""
+    vin = vin.upper()
+    return vin[:3] + vin[11:14] if vin[2] == '9' else vin[:3]
+
+
+def compile_keys(keys: str) -> Tuple[re.Pattern, int]:
+    """
+    Compile a vPIC pattern Keys string
+
+    Keys cover VIN positions 4-8, then '|' and positions 10 onward; '*'
+    matches any character and [..] a character set. Returns the regex and
+    the pattern's specificity (positions it pins down).
+    """
+    regex = []
+    specificity = 0
+    i = 0
+    while i < len(keys):
+        char = keys[i]
+        if char == '[':
+            end = keys.index(']', i)
+            regex.append(keys[i:end + 1])
+            specificity += 1
+            i = end + 1
+            continue
+        if char == '*':
+            regex.append('.')
+        else:
+            regex.append(re.escape(char))
+            specificity += 1 if char != '|' else 0
+        i += 1
+    return re.compile(''.join(regex), re.IGNORECASE), specificity
+
+
+class VpicSnapshot:
+    """
+    Read-only decoder over a snapshot built by import_vpic
+
+    Compiled patterns are kept per WMI in a bounded LRU, so repeat decodes
+    of a manufacturer only run regex matches.
+    """
+
+    def __init__(self, path: str, max_wmis: int = 2000):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.max_wmis = max_wmis
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wmis: 'OrderedDict[str, Optional[Dict[str, Any]]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.meta = dict(self._connect().execute("SELECT key, value FROM meta").fetchall())
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _load_wmi(self, wmi: str) -> Optional[Dict[str, Any]]:
+        """WMI record with its schemas and compiled patterns, or None if unknown"""
+        with self._lock:
+            if wmi in self._wmis:
+                self._wmis.move_to_end(wmi)
+                return self._wmis[wmi]
+
+        conn = self._connect()
+        row = conn.execute("SELECT make, manufacturer, vehicle_type FROM wmi WHERE wmi = ?", (wmi,)).fetchone()
+        record = None
+        if row is not None:
+            schemas = conn.execute(
+                "SELECT schema_id, year_from, year_to FROM schemas WHERE wmi = ?", (wmi,)
+            ).fetchall()
+            patterns = {}
+            for schema_id, _, _ in schemas:
+                if schema_id in patterns:
+                    continue
+                patterns[schema_id] = [
+                    (*compile_keys(keys), pattern_id, element, value)
+                    for pattern_id, keys, element, value in conn.execute(
+                        "SELECT id, keys, element, value FROM patterns WHERE schema_id = ?", (schema_id,)
+                    )
+                ]
+            record = {'make': row[0], 'manufacturer': row[1], 'vehicle_type': row[2],
+                      'schemas': schemas, 'patterns': patterns}
+
+        with self._lock:
+            self._wmis[wmi] = record
+            while len(self._wmis) > self.max_wmis:
+                self._wmis.popitem(last=False)
+        return record
+
+    def decode(self, vin: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Decode a VIN into DecodeVin-style Results ([{'Variable', 'Value'}, ...])
+
+        Returns None when the WMI, model year or any REQUIRED element can't
+        be resolved, so the caller can fall back to the remote API. Where
+        several patterns set an element, the most specific one wins.
+        """
+        vin = vin.upper()
+        year = model_year(vin)
+        record = self._load_wmi(wmi_of(vin)) if year else None
+        if record is None:
+            self.misses += 1
+            return None
+
+        subject = vin[3:8] + '|' + vin[9:]
+        best: Dict[str, Tuple[int, int, str]] = {}
+        for schema_id, year_from, year_to in record['schemas']:
+            if (year_from and year < year_from) or (year_to and year > year_to):
+                continue
+            for regex, specificity, pattern_id, element, value in record['patterns'][schema_id]:
+                if regex.match(subject) and (specificity, pattern_id) > best.get(element, (-1, -1, ''))[:2]:
+                    best[element] = (specificity, pattern_id, value)
+
+        values = {element: value for element, (_, _, value) in best.items()}
+        values.setdefault('Make', record['make'])
+        values['Model Year'] = str(year)
+        values['Manufacturer Name'] = record['manufacturer']
+        values['Vehicle Type'] = record['vehicle_type']
+
+        if not all(values.get(name) for name in REQUIRED):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [{'Variable': name, 'Value': value} for name, value in values.items() if value]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'path': self.path,
+            'imported_at': self.meta.get('imported_at'),
+            'source': self.meta.get('source'),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            'wmis_loaded': len(self._wmis)
+        }
+
+
+def _read_table(source_dir: str, table: str) -> Iterable[Dict[str, str]]:
+    path = os.path.join(source_dir, f'{table}.csv')
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def _names(source_dir: str, table: str) -> Dict[str, str]:
+    return {row['Id']: row['Name'] for row in _read_table(source_dir, table)}
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value not in (None, '', 'NULL') else None
+    except ValueError:
+        return None
+
+
+def import_vpic(source_dir: str, path: str) -> Dict[str, int]:
+    """Build a snapshot at `path` from vPIC table CSV exports in `source_dir`; returns row counts"""
+    makes = _names(source_dir, 'Make')
+    manufacturers = _names(source_dir, 'Manufacturer')
+    vehicle_types = _names(source_dir, 'VehicleType')
+    wmi_makes = {row['WmiId']: makes.get(row['MakeId']) for row in _read_table(source_dir, 'Wmi_Make')}
+
+    elements = {}
+    lookups = {}
+    for row in _read_table(source_dir, 'Element'):
+        if row['Name'] in ELEMENTS:
+            elements[row['Id']] = row['Name']
+            table = (row.get('LookupTable') or '').strip()
+            if table and table != 'NULL' and table not in lookups:
+                lookups[table] = _names(source_dir, table)
+    element_lookup = {
+        row['Id']: lookups.get((row.get('LookupTable') or '').strip())
+        for row in _read_table(source_dir, 'Element') if row['Id'] in elements
+    }
+
+    wmis = {}
+    for row in _read_table(source_dir, 'Wmi'):
+        wmis[row['Id']] = (
+            row['Wmi'].strip().upper(),
+            wmi_makes.get(row['Id']) or makes.get(row.get('MakeId')),
+            manufacturers.get(row.get('ManufacturerId')),
+            vehicle_types.get(row.get('VehicleTypeId'))
+        )
+
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    counts = {}
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT OR REPLACE INTO wmi VALUES (?, ?, ?, ?)", wmis.values())
+        counts['wmi'] = len(wmis)
+
+        schema_rows = [
+            (wmis[row['WmiId']][0], _int(row['VinSchemaId']), _int(row.get('YearFrom')), _int(row.get('YearTo')))
+            for row in _read_table(source_dir, 'Wmi_VinSchema') if row['WmiId'] in wmis
+        ]
+        conn.executemany("INSERT INTO schemas VALUES (?, ?, ?, ?)", schema_rows)
+        counts['schemas'] = len(schema_rows)
+
+        pattern_rows = []
+        for row in _read_table(source_dir, 'Pattern'):
+            element = elements.get(row['ElementId'])
+            if element is None:
+                continue
+            lookup = element_lookup.get(row['ElementId'])
+            value = lookup.get(row['AttributeId'], row['AttributeId']) if lookup else row['AttributeId']
+            if value and value != 'NULL':
+                pattern_rows.append((_int(row['Id']), _int(row['VinSchemaId']), row['Keys'].strip(), element, value.strip()))
+        conn.executemany("INSERT INTO patterns VALUES (?, ?, ?, ?, ?)", pattern_rows)
+        counts['patterns'] = len(pattern_rows)
+
+        conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+            ('source', os.path.abspath(source_dir)),
+            ('imported_at', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+            ('counts', json.dumps(counts))
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, path)
+    return counts
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Build or query an offline vPIC snapshot')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('import', help='build a snapshot from vPIC table CSV exports')
+    build.add_argument('source_dir', help='directory with Wmi.csv, Pattern.csv, Element.csv, ...')
+    build.add_argument('path', help='snapshot SQLite file to write')
+    query = commands.add_parser('decode', help='decode VINs against a snapshot')
+    query.add_argument('path', help='snapshot SQLite file')
+    query.add_argument('vins', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        counts = import_vpic(args.source_dir, args.path)
+        print(f"Wrote {args.path}: {counts['wmi']} WMIs, {counts['schemas']} schemas, {counts['patterns']} patterns")
+        return 0
+
+    snapshot = VpicSnapshot(args.path)
+    missed = 0
+    for vin in args.vins:
+        started = time.perf_counter()
+        results = snapshot.decode(vin)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if results is None:
+            missed += 1
+            print(f'{vin}: not in snapshot ({elapsed_ms:.2f} ms)')
+        else:
+            values = ', '.join(f"{item['Variable']}={item['Value']}" for item in results)
+            print(f'{vin}: {values} ({elapsed_ms:.2f} ms)')
+    return 1 if missed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())